@@ -1,18 +1,25 @@
-from flask import Flask, request, url_for, abort, jsonify
+from flask import Flask, Response, request, url_for, abort, jsonify, g, stream_with_context, make_response
 from datetime import timedelta
 from flask import render_template, redirect
-from ldap_api import LdapApi, LdapApiException
+from ldap_api import LdapApi, LdapApiException, GROUP_ATTRIBUTES
+from ldap_batch import LdapBatchException
+from auth_context import AuthContext
+from serialize import object_to_dict
 from ldap3.utils import conv
-from middleware import middleware
+from middleware import middleware, UID_ENVIRON_KEY
 import token_handler
 from os.path import join
 from urllib.parse import unquote
+from functools import wraps
+import base64
+import hashlib
+import time
 import jwt
 
-import json
 import config
 
 import mail
+import metrics
 
 api = LdapApi(config)
 app = Flask(__name__)
@@ -24,23 +31,142 @@ def dn_to_uid(dn):
 def sanitize(x):
     return conv.escape_filter_chars(x, encoding="utf-8")
 
-# converts ldap-style objects to python dicts (yes, there is no better way)
-def object_to_dict(obj):
-    dictionary = json.loads(obj.entry_to_json())["attributes"]
-    keys = dictionary.keys()
-    new_dictionary = {}
-    for key in list(keys):
-        if len(dictionary[key]) >= 1:
-            new_dictionary[key.replace("-", "_")] = dictionary[key][0]
-        else:
-            new_dictionary[key] = None
-    return new_dictionary
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode()
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode('utf-8')
+    except ValueError:
+        return None
+
+def list_response(entries, page, key):
+    """ Answers with the entries (an iterator, e.g. from a paged search) as json array.
+    With ?limit=n only n entries are returned, read with page(after, n), ordered by
+    the attribute key. The X-Next-Cursor header holds the value of ?cursor= for the
+    next page, it names the last entry returned, so every page is one search, no
+    matter how far into the list it is. With ?stream=1 the array is serialized and
+    sent in chunks.
+    """
+    limit = request.args.get('limit', type=int)
+    if limit != None:
+        entries.close()
+        after = None
+        if 'cursor' in request.args:
+            after = decode_cursor(request.args['cursor'])
+            if not after:
+                return abort(400)
+        if limit < 1:
+            return abort(400)
+        items = page(after, limit + 1)
+        response = jsonify([object_to_dict(x) for x in items[:limit]])
+        if len(items) > limit:
+            response.headers['X-Next-Cursor'] = encode_cursor(str(items[limit - 1][key]))
+        return response
+    if request.args.get('stream'):
+        # read completely first, so the paged search gives its pooled connection
+        # back before a slow client has read the response
+        entries = list(entries)
+        def generate():
+            yield '['
+            for i, entry in enumerate(entries):
+                yield (',' if i else '') + app.json.dumps(object_to_dict(entry), separators=(',', ':'))
+            yield ']'
+        return Response(stream_with_context(generate()), mimetype='application/json')
+    return jsonify([object_to_dict(x) for x in entries])
+
+def etag_response(build):
+    """ Answers 304 if the request's If-None-Match names the current ETag, which
+    is derived from the directory's contextCSN (and the replica's, if it serves
+    reads), the caller and the query.
+    Otherwise the response is built by build() and gets the ETag.
+    Without a contextCSN every response is built.
+    """
+    version = api.get_directory_version()
+    if version == None:
+        return build()
+    replica = api.replicated()
+    if replica != None:
+        # the body may come from the replica, which lags behind the directory.
+        # With its version in the ETag, the ETag changes again once it caught up.
+        version = '%s|%s' % (version, replica.version)
+    etag = hashlib.sha1(('%s|%s|%s' % (version, current_uid(), request.full_path)).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def request_uids():
+    """ Returns the list of uids in the json body of a bulk request or None. """
+    uids = request.json.get('uids')
+    if not isinstance(uids, list) or not all(isinstance(x, str) for x in uids):
+        return None
+    return uids
+
+def current_uid():
+    """ Returns the uid of the caller's bearer token or None. """
+    if UID_ENVIRON_KEY in request.environ:
+        return request.environ[UID_ENVIRON_KEY]
+    return token_handler.get_jwt_user(request.headers.get('Authorization'))
+
+def auth_context():
+    """ Returns the AuthContext of the caller, built once per request.
+    Returns None if the request carries no valid token.
+    """
+    if 'auth' not in g:
+        uid = current_uid()
+        g.auth = AuthContext.load(api, uid) if uid != None else None
+    return g.auth
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if 'request_started' in g:
+        metrics.HTTP_REQUESTS.observe(time.perf_counter() - g.request_started,
+            endpoint=request.endpoint or 'unknown', method=request.method, status=response.status_code)
+    # operations of streamed responses happen later and are not included
+    response.headers['X-LDAP-Operations'] = str(g.get('ldap_operations', 0))
+    return response
+
+class LdapBudgetExceeded(Exception):
+    pass
+
+def ldap_budget(max_operations):
+    """ Decorator for routes that should not need more than max_operations LDAP
+    operations. Going over the budget is logged, in testing mode it raises
+    LdapBudgetExceeded, so N+1 queries show up in tests.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            result = f(*args, **kwargs)
+            used = g.get('ldap_operations', 0)
+            if used > max_operations:
+                message = '%s needed %d LDAP operations, the budget is %d' % (request.endpoint, used, max_operations)
+                if app.testing:
+                    raise LdapBudgetExceeded(message)
+                print("Warning: " + message)
+            return result
+        return wrapper
+    return decorator
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """ Metrics of this process in the Prometheus text format, no login needed. """
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/')
 def homepage():
     return abort(401) # Security by obscurity
 
 @app.route('/login', methods=['POST'])
+@ldap_budget(3)
 def login():
     username = request.json.get('username')
     password = request.json.get('password')
@@ -55,8 +181,9 @@ def login():
         abort(403)
 
 @app.route('/inactive_info', methods=['GET'])
+@ldap_budget(6)
 def inactive_info():
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
+    uid = current_uid()
     if uid == None:
         return abort(401)
     inactive_user = None
@@ -67,14 +194,14 @@ def inactive_info():
             "inactive": False
         })
     # Get the owners of the group you are pending in
-    groups = api.get_groups_as_inactive_pending_member(uid)
+    groups = api.get_pending_group_owners(inactive_info.entry_dn)
     if len(groups) != 1:
         return jsonify({
             "inactive": True
         })
-    group = groups[0]
-    group_name = str(group.cn)
-    pending_group_owners = [object_to_dict(api.get_user(dn_to_uid(str(x)))) for x in group.owner]
+    (group_id, owner_dns), = groups.items()
+    group_name = str(api.get_group(group_id).cn)
+    pending_group_owners = [object_to_dict(x) for x in api.get_users_by_dns(owner_dns, config.DN_PEOPLE)]
     return jsonify({
         "inactive": True,
         "pending_group_name": group_name,
@@ -83,32 +210,33 @@ def inactive_info():
 
 
 @app.route('/whoami', methods=['GET'])
+@ldap_budget(3)
 def whoami():
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
+    uid = current_uid()
     if uid == None:
         return abort(401)
     info = api.get_user_info(uid)
     return object_to_dict(info)
 
 @app.route('/users', methods=['GET'])
+@ldap_budget(5)
 def users():
     """ Lists all users. Returns their uids in a json array.
         
     To access this, one must be owner in some group.
+    Supports paging with ?limit=&cursor= and streaming with ?stream=1 (see list_response).
     """
     # Check if user is admin in some group
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(uid):
+    if not ctx.active:
         return abort(401)
-    if not api.is_group_owner_anywhere(uid):
+    if not api.is_group_owner_anywhere(ctx.uid):
         return abort(403), "To access this endpoint, you have to be owner of a group"
 
     # Ok, they are. List all users and return them!
-    all_users = [object_to_dict(x) for x in api.get_users()]
-
-    return jsonify(all_users)
+    return list_response(api.iter_users(), api.get_users_page, 'uid')
 
 @app.route('/users/set_new_password_with_old_password', methods=['POST'])
 def user_set_password_with_old():
@@ -116,7 +244,7 @@ def user_set_password_with_old():
     the keys old_password and new_password. Says ok when done, 401 when not ok.
     You need to be logged in to do this.
     """
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
+    uid = current_uid()
     if uid == None:
         return abort(401)
 
@@ -172,7 +300,7 @@ def set_alternative_mail():
     Takes a json body with the key "alternative_mail".
     """
     alternative_mail = request.json.get('alternative_mail')
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
+    uid = current_uid()
     if uid == None:
         return abort(401)
     try:
@@ -187,6 +315,7 @@ def set_alternative_mail():
         return abort(401)
 
 @app.route('/groups', methods=['GET'])
+@ldap_budget(4)
 def groups():
     """ Gets all groups. Returns them as json:
     [
@@ -197,16 +326,18 @@ def groups():
         },
         ...
     ]
+    Supports paging with ?limit=&cursor= and streaming with ?stream=1 (see list_response)
+    and conditional requests with If-None-Match (see etag_response).
     """
-    username = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if username == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(username):
+    if not ctx.active:
         return abort(401)
-    groups = [object_to_dict(x) for x in api.get_groups()]
-    return jsonify(groups)
+    return etag_response(lambda: list_response(api.iter_groups(), api.get_groups_page, 'ou'))
 
 @app.route('/my_groups', methods=['GET'])
+@ldap_budget(4)
 def mygroups():
     """ Gets all of the groups you are a member of. Returns them as json:
     [
@@ -218,27 +349,31 @@ def mygroups():
         },
         ...
     ]
+    Supports conditional requests with If-None-Match (see etag_response).
     """
-    username = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if username == None:
-        return abort(401)
-    if not api.is_active(username):
-        return abort(401)
-    pending_groups = [object_to_dict(x) for x in api.get_groups_as_active_pending_member(username)]
-    member_groups = [object_to_dict(x) for x in api.get_groups_as_member(username)]
-    owned_groups = [object_to_dict(x) for x in api.get_groups_as_owner(username)]
-
-    # Groups can overlap. If you're owner you're always also member.
-    # But the interesting information is that you're owner.
-    member_groups = list(filter(lambda x: x not in owned_groups, member_groups))
-
-    # Add information about membership
-    for group in pending_groups:
-        group['membership'] = 'pending'
-    for group in member_groups:
-        group['membership'] = 'member'
-    for group in owned_groups:
-        group['membership'] = 'admin'
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    return etag_response(lambda: my_groups_response(ctx))
+
+def my_groups_response(ctx):
+    pending_groups = []
+    member_groups = []
+    owned_groups = []
+    my_dn = ctx.dn.lower()
+    for entry in api.get_groups_with_membership(ctx.dn):
+        group = object_to_dict(entry, GROUP_ATTRIBUTES)
+        is_pending = my_dn in (x.lower() for x in entry.pending.values)
+        if is_pending:
+            pending_groups.append(dict(group, membership='pending'))
+        # Groups can overlap. If you're owner you're always also member.
+        # But the interesting information is that you're owner.
+        if my_dn in (x.lower() for x in entry.owner.values):
+            owned_groups.append(dict(group, membership='admin'))
+        elif not is_pending or ctx.is_member(str(entry.ou)):
+            member_groups.append(dict(group, membership='member'))
 
     all_groups = []
     all_groups.extend(pending_groups)
@@ -247,16 +382,34 @@ def mygroups():
 
     return jsonify(all_groups)
 
+@app.route('/my_groups/owned_count', methods=['GET'])
+@ldap_budget(4)
+def my_owned_groups_count():
+    """ Returns the number of groups you own as json: {"count": 3}
+    """
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    return jsonify({
+        "count": len(ctx.owned_groups)
+    })
+
 @app.route('/groups/<group_id>/members', methods=['GET'])
+@ldap_budget(5)
 def group_members(group_id):
     group_id = sanitize(group_id)
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
+    return etag_response(lambda: group_members_response(group_id))
+
+def group_members_response(group_id):
     ldap_members = api.get_group_members(group_id)
     members = []
     for x in ldap_members:
@@ -267,14 +420,15 @@ def group_members(group_id):
     return jsonify(members)
 
 @app.route('/groups/<group_id>/guests', methods=['GET'])
+@ldap_budget(5)
 def group_guests(group_id):
     group_id = sanitize(group_id)
-    uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     ldap_members = api.get_group_guests(group_id)
     members = []
@@ -286,14 +440,15 @@ def group_guests(group_id):
     return jsonify(members)
 
 @app.route('/groups/<group_id>/active_pending_members', methods=['GET'])
+@ldap_budget(6)
 def group_active_pending_members(group_id):
     group_id = sanitize(group_id)
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     ldap_members = api.get_group_active_pending_members(group_id)
     members = []
@@ -305,14 +460,15 @@ def group_active_pending_members(group_id):
     return jsonify(members)
 
 @app.route('/groups/<group_id>/inactive_pending_members', methods=['GET'])
+@ldap_budget(6)
 def group_inactive_pending_members(group_id):
     group_id = sanitize(group_id)
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     ldap_members = api.get_group_inactive_pending_members(group_id)
     members = []
@@ -324,11 +480,12 @@ def group_inactive_pending_members(group_id):
     return jsonify(members)
 
 @app.route('/groups/<group_id>/owners', methods=['GET'])
+@ldap_budget(5)
 def group_owners(group_id):
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
     group_id = sanitize(group_id)
     ldap_owners = api.get_group_owners(group_id)
@@ -344,16 +501,34 @@ def group_owners(group_id):
 def add_user_to_group(group_id):
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     api.add_group_member(group_id, uid)
     return "ok"
 
+@app.route('/groups/<group_id>/add_members', methods=['POST'])
+def add_users_to_group(group_id):
+    """ Adds many users to a group at once. Takes a json body {"uids": [...]} and
+    returns the result for every uid: {"uid": "ok", "other.uid": "not found", ...}
+    """
+    group_id = sanitize(group_id)
+    uids = request_uids()
+    if uids == None:
+        return abort(400)
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    if not ctx.is_owner(group_id):
+        return abort(401)
+    return jsonify(api.add_group_members(group_id, uids))
+
 @app.route('/groups/<group_id>/remove_member', methods=['POST'])
 def remove_user_from_group(group_id):
     """ Removes a user from a group. Call this function if you want to either remove
@@ -363,19 +538,20 @@ def remove_user_from_group(group_id):
     """
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
+    my_uid = ctx.uid
     # 1st: Is the uid the group?
-    if not (any(x.uid == uid for x in api.get_group_guests(group_id)) or any(x.uid == uid for x in api.get_group_members(group_id))):
+    if not api.is_group_member(group_id, uid):
         return abort(400)
     # User is not Dashboardadmin, cause dashboardadmin is holy
     if (uid == "dashboardadmin"):
         return abort(400)
     # 2nd: Is the user an admin or just a user
-    if any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if ctx.is_owner(group_id):
         # Group owners can remove anyone from a group but themself
         if uid == my_uid:
             return abort(400) # admin tried to remove oneself
@@ -383,11 +559,16 @@ def remove_user_from_group(group_id):
         # If user removed from allgemein or from their last group, remove the user
         if group_id == "allgemein" or \
             (api.get_groups_as_member(uid) == [] and api.get_groups_as_owner(uid) == [] and api.get_groups_as_active_pending_member(uid) == []):
-            api.delete_user(uid)
+            try:
+                api.delete_user(uid)
+            except LdapBatchException as e:
+                # the membership is gone, the account is left as it was
+                print(e)
+                return "removed from the group, but could not delete the account", 500
         return "ok"
     else:
         # Users can remove themselves from any group but allgemein
-        if uid == my_uid and any(x.uid == uid for x in api.get_group_members(group_id)) and not group_id == "allgemein":
+        if uid == my_uid and ctx.is_member(group_id) and not group_id == "allgemein":
             api.remove_group_member(group_id, uid)
             return "ok"
         
@@ -397,35 +578,52 @@ def remove_user_from_group(group_id):
 def add_owner_to_group(group_id):
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     api.add_group_owner(group_id, uid)
     return "ok"
 
+@app.route('/groups/<group_id>/add_owners', methods=['POST'])
+def add_owners_to_group(group_id):
+    """ Adds many owners to a group at once, see add_members. """
+    group_id = sanitize(group_id)
+    uids = request_uids()
+    if uids == None:
+        return abort(400)
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    if not ctx.is_owner(group_id):
+        return abort(401)
+    return jsonify(api.add_group_owners(group_id, uids))
+
 @app.route('/groups/<group_id>/remove_owner', methods=['POST'])
 def remove_owner_from_group(group_id):
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
+    ctx = auth_context()
     # Auth is missing
-    if my_uid == None:
+    if ctx == None:
         return abort(401)
     # User is inactive
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
     # User is not an owner
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
+    my_uid = ctx.uid
     # User is not Dashboardadmin, cause dashboardadmin is holy
     if (uid == "dashboardadmin"):
         return abort(401)
     # User is the ownly owner despite dashboardadmin
-    if not any((x.uid != "dashboardadmin" and x.uid != my_uid) for x in api.get_group_owners(group_id)):
+    if not any((x != "dashboardadmin" and x != my_uid) for x in api.get_group_owner_uids(group_id)):
         return abort(401)
     api.remove_group_owner(group_id, uid)
     return "ok"
@@ -435,12 +633,12 @@ def add_guest_to_group(group_id):
     group_id = sanitize(group_id)
     guest_name = sanitize(request.json.get('name'))
     guest_mail = sanitize(request.json.get('mail'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
     uid = api.create_guest(guest_name, guest_mail)
     api.add_group_member(group_id, uid)
@@ -456,11 +654,12 @@ def add_guest_to_group(group_id):
 @app.route('/groups/<group_id>/request_access', methods=['POST'])
 def request_access_to_group(group_id):
     group_id = sanitize(group_id)
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
+    my_uid = ctx.uid
     api.add_group_active_pending_member(group_id, my_uid)
     group = api.get_group(group_id)
     user = api.get_user(my_uid)
@@ -478,19 +677,46 @@ def request_access_to_group(group_id):
 def accept_pending_member(group_id):
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
-    if not any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if not ctx.is_owner(group_id):
         return abort(401)
-    if any(x.uid == uid for x in api.get_group_inactive_pending_members(group_id)):
+    if api.is_group_inactive_pending_member(group_id, uid):
         api.activate_user(uid)
     api.remove_group_active_pending_member(group_id, uid)
     api.add_group_member(group_id, uid)
     return "ok"
 
+@app.route('/groups/<group_id>/accept_pending_members', methods=['POST'])
+def accept_pending_members(group_id):
+    """ Accepts many pending members at once, see add_members. """
+    group_id = sanitize(group_id)
+    uids = request_uids()
+    if uids == None:
+        return abort(400)
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    if not ctx.is_owner(group_id):
+        return abort(401)
+    inactive_uids = set(str(x.uid).lower() for x in api.get_group_inactive_pending_members(group_id))
+    results = {}
+    for uid in uids:
+        if uid.lower() in inactive_uids:
+            # activated once, even if the uid is in the list twice
+            inactive_uids.discard(uid.lower())
+            try:
+                api.activate_user(uid)
+            except (LdapApiException, LdapBatchException) as e:
+                results[uid] = str(e)
+    results.update(api.accept_group_pending_members(group_id, [x for x in uids if x not in results]))
+    return jsonify(results)
+
 @app.route('/groups/<group_id>/remove_pending_member', methods=['POST'])
 def remove_pending_member_from_group(group_id):
     """ Cancels a membership request. Call this function if you want to either remove
@@ -499,21 +725,38 @@ def remove_pending_member_from_group(group_id):
     """
     group_id = sanitize(group_id)
     uid = sanitize(request.json.get('uid'))
-    my_uid = token_handler.get_jwt_user(request.headers.get('Authorization'))
-    if my_uid == None:
+    ctx = auth_context()
+    if ctx == None:
         return abort(401)
-    if not api.is_active(my_uid):
+    if not ctx.active:
         return abort(401)
+    my_uid = ctx.uid
     # Users can remove their own requests from a group
-    if uid == my_uid and any(x.uid == uid for x in api.get_group_active_pending_members(group_id)):
+    if uid == my_uid and api.is_group_active_pending_member(group_id, uid):
         api.remove_group_active_pending_member(group_id, uid)
         return "ok"
     # Group owners can remove any pending member
-    if any(x.uid == my_uid for x in api.get_group_owners(group_id)):
+    if ctx.is_owner(group_id):
         api.remove_group_active_pending_member(group_id, uid)
         return "ok"
     return abort(401)
 
+@app.route('/groups/<group_id>/remove_pending_members', methods=['POST'])
+def remove_pending_members_from_group(group_id):
+    """ Removes many membership requests at once as an owner, see add_members. """
+    group_id = sanitize(group_id)
+    uids = request_uids()
+    if uids == None:
+        return abort(400)
+    ctx = auth_context()
+    if ctx == None:
+        return abort(401)
+    if not ctx.active:
+        return abort(401)
+    if not ctx.is_owner(group_id):
+        return abort(401)
+    return jsonify(api.remove_group_pending_members(group_id, uids))
+
 @app.route('/confirm', methods=['GET'])
 def confirm_mail():
     token_str = request.args.get('key')
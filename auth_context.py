@@ -0,0 +1,41 @@
+from ldap_api import LdapApiException
+
+# Everything the group endpoints need to know about the caller of a request.
+# It is built once per request from the caller's own entry (its DN tells
+# whether the account is active, memberOf lists the groups it is member of),
+# the groups the caller owns are looked up on first use.
+
+class AuthContext():
+    def __init__(self, api, uid, dn, member_of):
+        self.api = api
+        self.uid = uid
+        self.dn = dn
+        self.member_of = set(x.lower() for x in member_of)
+        self.owned = None
+
+    @classmethod
+    def load(cls, api, uid):
+        try:
+            entry = api.get_user_memberships(uid)
+        except LdapApiException:
+            return cls(api, uid, None, [])
+        return cls(api, uid, entry.entry_dn, entry.memberOf.values)
+
+    @property
+    def active(self):
+        return self.dn is not None and self.api.is_dn_below(self.dn, self.api.config.DN_PEOPLE_ACTIVE)
+
+    @property
+    def owned_groups(self):
+        if self.owned is None:
+            if self.dn is None:
+                self.owned = set()
+            else:
+                self.owned = set(x.lower() for x in self.api.get_owned_group_ous(self.dn))
+        return self.owned
+
+    def is_owner(self, group):
+        return group.lower() in self.owned_groups
+
+    def is_member(self, group):
+        return self.api.get_group_dn(group).lower() in self.member_of
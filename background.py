@@ -0,0 +1,60 @@
+import os
+import threading
+
+# Threads of the API, started on first use instead of on import. gunicorn
+# imports the app once and forks the workers from it, threads don't survive
+# the fork, so every worker process starts its own.
+
+class PerProcess():
+    def __init__(self, setup):
+        """ setup() starts the threads, it is called once in every process. """
+        self.setup = setup
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.setup()
+            # only now, other threads skip the lock once the pid is set
+            self.pid = os.getpid()
+
+    def reset(self):
+        """ Lets the next start() call setup() again. Returns False if this
+        process hasn't started, there is nothing to stop then. """
+        with self.lock:
+            if self.pid != os.getpid():
+                return False
+            self.pid = None
+            return True
+
+class Periodic():
+    def __init__(self, name, task, interval, error):
+        """ Calls task() in a thread named name every interval() seconds until
+        stop() is called. Exceptions are printed after error. """
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.error = error
+        self.stopped = threading.Event()
+        self.process = PerProcess(self.spawn)
+
+    def start(self):
+        self.process.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def spawn(self):
+        threading.Thread(target=self.run, name=self.name, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.task()
+            except Exception as e:
+                print("Error: %s: %s" % (self.error, e))
+            self.stopped.wait(self.interval())
@@ -0,0 +1,111 @@
+""" Compares reads from the in-memory replica with reads from (mock) LDAP and
+checks that changes made by another writer reach the replica.
+
+Usage: python benchmarks/directory_replica.py [number of users]
+"""
+import os
+import sys
+import time
+import timeit
+import types
+from ldap3 import Connection, MOCK_SYNC, MODIFY_REPLACE
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+SUFFIX = 'dc=sog'
+PEOPLE = 'ou=active,ou=people,o=sog-de,dc=sog'
+GROUPS = 'ou=groups,o=sog-de,dc=sog'
+
+config = types.ModuleType('config')
+config.LDAP_HOST = 'benchmark'
+config.LDAP_PORT = 389
+config.LDAP_CLIENT_STRATEGY = MOCK_SYNC
+config.LDAP_POOL_MIN_SIZE = 0
+config.LDAP_CACHE_TTL = 0
+config.LDAP_SUFFIX = SUFFIX
+config.DN_GROUPS = GROUPS
+config.DN_PEOPLE = 'ou=people,o=sog-de,dc=sog'
+config.DN_PEOPLE_ACTIVE = PEOPLE
+config.DN_PEOPLE_INACTIVE = 'ou=inactive,ou=people,o=sog-de,dc=sog'
+config.DN_PEOPLE_GUESTS = 'ou=guests,ou=people,o=sog-de,dc=sog'
+config.BIND_DN = 'uid=dashboard,ou=services,dc=sog'
+config.BIND_PW = 'benchmark'
+sys.modules['config'] = config
+
+from ldap_api import LdapApi
+
+class Csn():
+    """ Hands out increasing CSNs, like the syncprov overlay does on every write. """
+    def __init__(self):
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return '20260101000000.%06dZ#000000#000#000000' % self.counter
+
+def seed(server, count, csn):
+    conn = Connection(server, client_strategy=MOCK_SYNC)
+    conn.bind()
+    conn.strategy.add_entry(config.BIND_DN, {'objectClass': ['inetOrgPerson'], 'uid': 'dashboard', 'userPassword': config.BIND_PW})
+    members = []
+    for i in range(count):
+        dn = 'uid=user%d,%s' % (i, PEOPLE)
+        members.append(dn)
+        conn.strategy.add_entry(dn, {
+            'objectClass': ['inetOrgPerson'], 'uid': 'user%d' % i, 'cn': 'User %d' % i,
+            'mail': 'user%d@studieren-ohne-grenzen.org' % i, 'memberOf': ['ou=allgemein,' + GROUPS],
+            'entryCSN': csn.next(),
+        })
+    conn.strategy.add_entry('ou=allgemein,' + GROUPS, {
+        'objectClass': ['groupOfNames'], 'ou': 'allgemein', 'cn': 'Allgemein', 'businessCategory': 'allgemein',
+        'member': members, 'entryCSN': csn.next(),
+    })
+    conn.strategy.add_entry(SUFFIX, {'objectClass': ['dcObject'], 'dc': 'sog', 'contextCSN': csn.next()})
+    return conn
+
+def external_write(conn, csn, dn, changes):
+    """ A write of another client: the entry and the suffix get a new CSN. """
+    changes = dict(changes, entryCSN=[(MODIFY_REPLACE, [csn.next()])])
+    conn.modify(dn, changes)
+    conn.modify(SUFFIX, {'contextCSN': [(MODIFY_REPLACE, [csn.next()])]})
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    csn = Csn()
+    api = LdapApi(config)
+    conn = seed(api.server, count, csn)
+
+    ldap_seconds = min(timeit.repeat(lambda: api.get_user('user%d' % (count // 2)), number=20, repeat=3)) / 20
+
+    config.LDAP_REPLICA = True
+    server = api.server
+    api = LdapApi(config)
+    # the mock keeps its entries on the Server object, nothing is connected yet
+    api.server = server
+    api.replica.poll_interval = 0.05
+    assert wait_for(lambda: api.replicated() is not None, timeout=60), 'the replica did not load'
+    replica_seconds = min(timeit.repeat(lambda: api.get_user('user%d' % (count // 2)), number=1000, repeat=3)) / 1000
+    print('get_user from LDAP     %10.1f us' % (ldap_seconds * 1e6))
+    print('get_user from replica  %10.1f us' % (replica_seconds * 1e6))
+
+    # changes of other writers arrive with the next poll
+    external_write(conn, csn, 'uid=user1,' + PEOPLE, {'cn': [(MODIFY_REPLACE, ['Renamed'])]})
+    assert wait_for(lambda: str(api.get_user('user1').cn) == 'Renamed'), 'the change did not reach the replica'
+    external_write(conn, csn, 'ou=allgemein,' + GROUPS, {'member': [(MODIFY_REPLACE, ['uid=user2,' + PEOPLE])]})
+    assert wait_for(lambda: [x.uid.value for x in api.get_group_members('allgemein')] == ['user2']), 'the member change did not reach the replica'
+    # writes through the API are visible right away
+    api.add_group_member('allgemein', 'user3')
+    assert sorted(x.uid.value for x in api.get_group_members('allgemein')) == ['user2', 'user3']
+    print('changes reached the replica')
+    api.replica.stop()
+
+if __name__ == '__main__':
+    main()
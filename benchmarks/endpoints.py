@@ -0,0 +1,200 @@
+""" Times the main endpoints against a synthetic directory in an ldap3 MOCK_SYNC
+server, so no LDAP server is needed. Reports latency percentiles and the
+number of LDAP operations per request (X-LDAP-Operations).
+
+Usage: python benchmarks/endpoints.py [--users 5000] [--groups 200] [--requests 100] [--seed 1] [--no-cache]
+
+The mock evaluates every search in Python, so absolute numbers are far from
+production. Compare runs of the same size, and watch the operation counts.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import runpy
+import sys
+import time
+import types
+from ldap3 import Connection, MOCK_SYNC, MODIFY_ADD
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'benchmark'
+
+def load_config(args):
+    """ Installs the settings of config.sample.py, pointed at a mock server, as the config module. """
+    config = types.ModuleType('config')
+    for key, value in runpy.run_path(os.path.join(ROOT, 'config.sample.py')).items():
+        if key.isupper():
+            setattr(config, key, value)
+    config.LDAP_HOST = 'benchmark'
+    config.LDAP_CLIENT_STRATEGY = MOCK_SYNC
+    config.BIND_PW = PASSWORD
+    config.JWT_SECRET = 'benchmark-secret-of-at-least-32-bytes'
+    # the pool may only connect once the service account exists in the directory
+    config.LDAP_POOL_MIN_SIZE = 0
+    if args.no_cache:
+        config.LDAP_CACHE_TTL = 0
+    sys.modules['config'] = config
+    return config
+
+class Directory():
+    """ A synthetic directory: 80% active, 15% inactive and 5% guest accounts,
+    one group everybody active is member of and groups with long-tailed sizes,
+    1-3 owners and a few pending members each.
+    """
+    def __init__(self, config, user_count, group_count, rng):
+        self.config = config
+        self.rng = rng
+        self.active = ['vorname.nachname%d' % i for i in range(int(user_count * 0.8))]
+        self.inactive = ['inaktiv.nachname%d' % i for i in range(int(user_count * 0.15))]
+        self.guests = ['guest.vorname%d' % i for i in range(user_count - len(self.active) - len(self.inactive))]
+        self.inactive_set = set(self.inactive)
+        self.groups = {'allgemein': {'owner': self.active[:2], 'member': list(self.active), 'pending': []}}
+        for i in range(group_count - 1):
+            size = min(len(self.active), int(rng.paretovariate(1.2) * 10))
+            members = rng.sample(self.active, size)
+            members += rng.sample(self.guests, min(len(self.guests), rng.randint(0, 2)))
+            pending = rng.sample(self.active, rng.randint(0, 3)) + rng.sample(self.inactive, min(len(self.inactive), rng.randint(0, 2)))
+            self.groups['lg%d' % i] = {
+                'owner': members[:rng.randint(1, 3)],
+                'member': members,
+                'pending': [x for x in pending if x not in members],
+            }
+
+    def dn(self, uid):
+        if uid in self.inactive_set:
+            return 'uid=%s,%s' % (uid, self.config.DN_PEOPLE_INACTIVE)
+        if uid.startswith('guest.'):
+            return 'uid=%s,%s' % (uid, self.config.DN_PEOPLE_GUESTS)
+        return 'uid=%s,%s' % (uid, self.config.DN_PEOPLE_ACTIVE)
+
+    def group_dn(self, ou):
+        return 'ou=%s,%s' % (ou, self.config.DN_GROUPS)
+
+    def seed(self, server):
+        conn = Connection(server, client_strategy=MOCK_SYNC)
+        conn.bind()
+        conn.strategy.add_entry(self.config.BIND_DN, {'objectClass': ['inetOrgPerson'], 'uid': 'dashboard', 'userPassword': PASSWORD})
+        member_of = {}
+        for ou, roles in self.groups.items():
+            for uid in roles['member']:
+                member_of.setdefault(uid, []).append(self.group_dn(ou))
+        for uid in self.active + self.inactive + self.guests:
+            conn.strategy.add_entry(self.dn(uid), {
+                'objectClass': ['inetOrgPerson', 'top'],
+                'uid': uid,
+                'cn': uid.replace('.', ' ').title(),
+                'sn': uid.split('.')[-1],
+                'mail': uid + '@studieren-ohne-grenzen.org',
+                'userPassword': PASSWORD,
+                'memberOf': member_of.get(uid, []),
+            })
+        for ou, roles in self.groups.items():
+            conn.strategy.add_entry(self.group_dn(ou), {
+                'objectClass': ['groupOfNames', 'top'],
+                'ou': ou,
+                'cn': ou.title(),
+                'businessCategory': 'lokalgruppe',
+                'mail': ou + '@studieren-ohne-grenzen.org',
+                'owner': [self.dn(x) for x in roles['owner']],
+                'member': [self.dn(x) for x in roles['member']],
+                'pending': [self.dn(x) for x in roles['pending']],
+            })
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def benchmark(client, auth, count, prepare):
+    """ Sends count requests built by prepare() and returns the timings and operation counts. """
+    timings = []
+    operations = []
+    for _ in range(count):
+        method, path, uid, body = prepare()
+        headers = auth(uid) if uid is not None else {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            response = client.open(path, method=method, headers=headers, json=body)
+            timings.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError('%s %s answered %s' % (method, path, response.status_code))
+        operations.append(int(response.headers['X-LDAP-Operations']))
+    return timings, operations
+
+def main():
+    parser = argparse.ArgumentParser(description='Times vogelnest endpoints against a mock directory.')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--groups', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-cache', action='store_true', help='disable the directory cache')
+    args = parser.parse_args()
+
+    config = load_config(args)
+    rng = random.Random(args.seed)
+    directory = Directory(config, args.users, args.groups, rng)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        import token_handler
+    directory.seed(app.api.server)
+    print('Seeded %d users and %d groups in %.1f s' % (args.users, len(directory.groups), time.perf_counter() - started))
+
+    def auth(uid):
+        return {'Authorization': 'Bearer %s' % token_handler.create_session_jwt_token(uid)}
+
+    small_groups = [ou for ou in directory.groups if ou != 'allgemein']
+
+    def accept_pending_member():
+        # an owner accepts someone who requested access just before, inactive
+        # users are activated by the request
+        candidates = directory.inactive if directory.inactive and rng.random() < 0.5 else directory.active
+        for ou in rng.sample(small_groups, len(small_groups)):
+            group = directory.groups[ou]
+            # sorted, so the choice only depends on the seed
+            free = sorted(set(candidates).difference(group['member'], group['pending']))
+            if free:
+                break
+        else:
+            # every candidate is in every group already, nothing left to accept
+            ou = rng.choice(small_groups)
+            return 'GET', '/groups/%s/members' % ou, directory.groups[ou]['owner'][0], None
+        uid = rng.choice(free)
+        app.api.modify(directory.group_dn(ou), {'pending': [(MODIFY_ADD, [directory.dn(uid)])]})
+        app.api.invalidate_group(ou)
+        if uid in directory.inactive_set:
+            directory.inactive.remove(uid)
+            directory.inactive_set.discard(uid)
+            directory.active.append(uid)
+        group['member'].append(uid)
+        return 'POST', '/groups/%s/accept_pending_member' % ou, group['owner'][0], {'uid': uid}
+
+    scenarios = [
+        ('POST /login', lambda: ('POST', '/login', None, {'username': rng.choice(directory.active), 'password': PASSWORD})),
+        ('GET /my_groups', lambda: ('GET', '/my_groups', rng.choice(directory.active), None)),
+        ('GET /groups/<id>/members', lambda: (lambda ou: ('GET', '/groups/%s/members' % ou, directory.groups[ou]['owner'][0], None))(rng.choice(small_groups))),
+        ('GET /groups/allgemein/members', lambda: ('GET', '/groups/allgemein/members', directory.groups['allgemein']['owner'][0], None)),
+        # only group owners may list all users
+        ('GET /users', lambda: ('GET', '/users', directory.groups[rng.choice(small_groups)]['owner'][0], None)),
+        ('POST accept_pending_member', accept_pending_member),
+    ]
+
+    print('%-30s %9s %9s %9s %9s %9s %9s' % ('endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'ops mean', 'ops max'))
+    client = app.app.test_client()
+    for name, prepare in scenarios:
+        timings, operations = benchmark(client, auth, args.requests, prepare)
+        print('%-30s %9.2f %9.2f %9.2f %9.2f %9.1f %9d' % (
+            name,
+            percentile(timings, 50) * 1000,
+            percentile(timings, 90) * 1000,
+            percentile(timings, 99) * 1000,
+            max(timings) * 1000,
+            sum(operations) / len(operations),
+            max(operations),
+        ))
+
+if __name__ == '__main__':
+    main()
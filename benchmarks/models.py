@@ -0,0 +1,74 @@
+""" Compares the memory held by ldap3 entries with the User and Group models.
+
+Usage: python benchmarks/models.py [number of users] [number of groups]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+from ldap3 import Server, Connection, MOCK_SYNC
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from models import User, Group
+
+PEOPLE = 'ou=active,ou=people,o=sog-de,dc=sog'
+GROUPS = 'ou=groups,o=sog-de,dc=sog'
+USER_ATTRIBUTES = ['uid', 'cn', 'mail']
+GROUP_ATTRIBUTES = ['ou', 'cn', 'businessCategory', 'mail', 'owner', 'member', 'pending']
+
+def create_directory(users, groups):
+    conn = Connection(Server('benchmark'), client_strategy=MOCK_SYNC)
+    conn.bind()
+    dns = []
+    for i in range(users):
+        uid = 'vorname.nachname%d' % i
+        dns.append('uid=%s,%s' % (uid, PEOPLE))
+        conn.strategy.add_entry(dns[-1], {
+            'objectClass': ['inetOrgPerson', 'top'],
+            'uid': uid,
+            'cn': 'Vorname Nachname %d' % i,
+            'mail': uid + '@studieren-ohne-grenzen.org',
+        })
+    for i in range(groups):
+        members = [dns[(i * 37 + j) % users] for j in range(100)]
+        conn.strategy.add_entry('ou=lg%d,%s' % (i, GROUPS), {
+            'objectClass': ['groupOfNames', 'top'],
+            'ou': 'lg%d' % i,
+            'cn': 'Lokalgruppe %d' % i,
+            'businessCategory': 'lokalgruppe',
+            'mail': 'lg%d@studieren-ohne-grenzen.org' % i,
+            'owner': members[:2],
+            'member': members,
+            'pending': members[-3:],
+        })
+    return conn
+
+def retained(conn, base, search_filter, attributes, convert):
+    """ Bytes still allocated for the converted result after the connection moved on. """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    conn.search(base, search_filter, attributes=attributes)
+    result = convert(conn)
+    # the pool hands the connection to the next operation, which replaces the response
+    conn.search(PEOPLE, '(uid=nobody)', attributes=['uid'])
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, len(result)
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    groups = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    conn = create_directory(users, groups)
+    for label, base, search_filter, attributes, model in [
+        ('users', PEOPLE, '(objectClass=inetOrgPerson)', USER_ATTRIBUTES, User),
+        ('groups with 100 members', GROUPS, '(objectClass=groupOfNames)', GROUP_ATTRIBUTES, Group),
+    ]:
+        entries_size, count = retained(conn, base, search_filter, attributes, lambda c: c.entries)
+        models_size, _ = retained(conn, base, search_filter, attributes, lambda c: [model.from_response(x) for x in c.response])
+        print('%-24s ldap3 Entry %8.1f MB   %-5s %8.1f MB   %4.1fx less, for %d entries' % (
+            label, entries_size / 1e6, model.__name__, models_size / 1e6, entries_size / models_size, count))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+""" Compares object_to_dict with the former entry_to_json/json.loads round trip.
+
+Usage: python benchmarks/object_to_dict.py [number of entries]
+"""
+import json
+import os
+import sys
+import timeit
+from ldap3 import Server, Connection, MOCK_SYNC
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from serialize import object_to_dict
+
+def entry_to_json_round_trip(obj):
+    dictionary = json.loads(obj.entry_to_json())["attributes"]
+    new_dictionary = {}
+    for key in list(dictionary.keys()):
+        if len(dictionary[key]) >= 1:
+            new_dictionary[key.replace("-", "_")] = dictionary[key][0]
+        else:
+            new_dictionary[key] = None
+    return new_dictionary
+
+def create_entries(count):
+    conn = Connection(Server('benchmark'), client_strategy=MOCK_SYNC)
+    conn.bind()
+    for i in range(count):
+        uid = 'vorname.nachname%d' % i
+        conn.strategy.add_entry('uid=%s,ou=active,ou=people,o=sog-de,dc=sog' % uid, {
+            'objectClass': ['inetOrgPerson', 'top'],
+            'uid': uid,
+            'cn': 'Vorname Nachname %d' % i,
+            'mail': uid + '@studieren-ohne-grenzen.org',
+        })
+    conn.search('ou=people,o=sog-de,dc=sog', '(objectClass=inetOrgPerson)', attributes=['uid', 'cn', 'mail', 'mail-alternative'])
+    return conn.entries
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    entries = create_entries(count)
+    assert [object_to_dict(x) for x in entries] == [entry_to_json_round_trip(x) for x in entries]
+    for name, function in [('entry_to_json + json.loads', entry_to_json_round_trip), ('object_to_dict', object_to_dict)]:
+        seconds = min(timeit.repeat(lambda: [function(x) for x in entries], number=1, repeat=5))
+        print('%-28s %8.1f ms for %d entries' % (name, seconds * 1000, count))
+
+if __name__ == '__main__':
+    main()
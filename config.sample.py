@@ -10,9 +10,56 @@ DN_PEOPLE_ACTIVE = 'ou=active,ou=people,o=sog-de,dc=sog'
 DN_PEOPLE_INACTIVE = 'ou=inactive,ou=people,o=sog-de,dc=sog'
 DN_PEOPLE_GUESTS = 'ou=guests,ou=people,o=sog-de,dc=sog'
 
+# Entry holding the contextCSN, used for ETags of the group listings
+LDAP_SUFFIX = 'dc=sog'
+
 BIND_DN = 'uid=dashboard,ou=services,dc=sog'
 BIND_PW = ''
 
+# ldap3 client strategy, the benchmarks use MOCK_SYNC to run without a server
+LDAP_CLIENT_STRATEGY = 'SYNC'
+
+# Connections to the LDAP server are shared between threads via a pool
+LDAP_POOL_MIN_SIZE = 1
+LDAP_POOL_MAX_SIZE = 10
+# Seconds after which idle connections above LDAP_POOL_MIN_SIZE are closed
+LDAP_POOL_IDLE_TIMEOUT = 300
+# Separate connections used to check passwords on login, they bind as the user
+LDAP_AUTH_POOL_MAX_SIZE = 5
+
+# Users and groups read from LDAP are cached for this many seconds (0 disables the cache)
+LDAP_CACHE_TTL = 30
+LDAP_CACHE_SIZE = 10000
+
+# Number of entries fetched per request when listing all users or groups
+LDAP_PAGE_SIZE = 500
+# /users and /groups with ?limit= are sorted by the server and continue after
+# the last uid or ou with a Virtual List View (sssvlv overlay). Without the
+# overlay each page reads and sorts the whole list in the API instead.
+
+# Serve users and groups from an in-memory copy of the directory. It polls the
+# contextCSN every LDAP_REPLICA_POLL_INTERVAL seconds for changes and is loaded
+# again completely every LDAP_REPLICA_RELOAD_INTERVAL seconds. Deletions made
+# by other clients than this API can't be seen by polling: deleted users stay
+# in the replica, and e.g. in group member listings, until the next full load.
+LDAP_REPLICA = False
+LDAP_REPLICA_POLL_INTERVAL = 5
+LDAP_REPLICA_RELOAD_INTERVAL = 600
+
+# Answer "is X member/owner/pending of G" from an in-memory index of all group
+# memberships. Writes through the API update it right away, it is loaded again
+# every LDAP_MEMBERSHIP_INDEX_RELOAD_INTERVAL seconds for changes made elsewhere.
+# Owners are authorized by the index, so it needs LDAP_INVALIDATION_DIR to see
+# the writes of the other workers right away, the API refuses to start without.
+LDAP_MEMBERSHIP_INDEX = False
+LDAP_MEMBERSHIP_INDEX_RELOAD_INTERVAL = 60
+
+# Directory for the Unix sockets over which the worker processes of one host
+# tell each other which cached users and groups they changed. Set it when
+# running several workers. It is created if missing and must belong to the
+# user the app runs as, with mode 0700, e.g. '/run/vogelnest/invalidation'.
+LDAP_INVALIDATION_DIR = None
+
 MAIL_DOMAIN = 'studieren-ohne-grenzen.org'
 MAIL_ALIAS_DOMAIN = 's-o-g.org'
 
@@ -27,3 +74,8 @@ MAIL_ADDRESS = ''
 MAIL_SERVER = ''
 MAIL_PASSWORD = ''
 
+
+# Mails are sent in the background by this many threads, each keeping an SMTP session open
+MAIL_OUTBOX_WORKERS = 2
+MAIL_OUTBOX_SIZE = 1000
+MAIL_MAX_RETRIES = 3
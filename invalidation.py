@@ -0,0 +1,85 @@
+import json
+import os
+import socket
+import stat
+import threading
+from background import PerProcess
+
+# Tells the other worker processes on this host which users and groups were
+# written, so they drop them from their caches.
+#
+# Every process binds a Unix datagram socket <pid>.sock in a shared directory.
+# The directory must belong to the user the app runs as and be accessible to
+# nobody else, otherwise other local users could send invalidations.
+# A message is sent to every other socket in the directory, sockets of
+# processes that are gone are removed on the way. A message that can't be
+# delivered because the receiver is too busy is dropped, the entry then
+# expires with the cache TTL.
+
+MAX_MESSAGE_SIZE = 4096
+
+class InvalidationBus():
+    def __init__(self, directory, handle):
+        """ handle(kind, key) is called from a background thread for every
+        message published by another process. """
+        self.directory = directory
+        self.handle = handle
+        self.process = PerProcess(self.listen)
+        self.sender = None
+
+    def path(self, pid):
+        return os.path.join(self.directory, '%d.sock' % pid)
+
+    def start(self):
+        self.process.start()
+
+    def listen(self):
+        # called once in every (forked) worker process, each binds its own socket
+        self.sender = None
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            info = os.lstat(self.directory)
+            if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o700:
+                print("Error: Not listening for cache invalidations, %s must be a directory of this user with mode 0700" % self.directory)
+                return
+            path = self.path(os.getpid())
+            if os.path.exists(path):
+                os.unlink(path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(path)
+        except OSError as e:
+            print("Error: Could not listen for cache invalidations in %s: %s" % (self.directory, e))
+            return
+        # sends without blocking, a busy receiver must not stall the request that wrote
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sender.setblocking(False)
+        threading.Thread(target=self.run, args=(receiver,), name='ldap-invalidation', daemon=True).start()
+
+    def run(self, receiver):
+        while True:
+            try:
+                kind, key = json.loads(receiver.recv(MAX_MESSAGE_SIZE).decode())
+                self.handle(kind, key)
+            except Exception as e:
+                print("Error: Could not handle a cache invalidation: %s" % e)
+
+    def publish(self, kind, key):
+        self.start()
+        if self.sender is None:
+            return
+        data = json.dumps([kind, key]).encode()
+        own = os.path.basename(self.path(os.getpid()))
+        for name in os.listdir(self.directory):
+            if not name.endswith('.sock') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self.sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # nobody listens anymore, the worker exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                print("Warning: Dropped the cache invalidation of %s %s for %s" % (kind, key, name))
@@ -1,31 +1,354 @@
-from ldap3 import Server, Connection, ALL, MODIFY_ADD, MODIFY_REPLACE, MODIFY_DELETE, HASHED_SALTED_SHA
+from ldap3 import Server, Connection, SYNC, BASE, ALL, ANONYMOUS, MODIFY_ADD, MODIFY_REPLACE, MODIFY_DELETE, HASHED_SALTED_SHA
 from ldap3.utils.hashed import hashed
-from ldap3.core.exceptions import LDAPBindError
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.protocol.controls import build_control
+from ldap3.core.exceptions import LDAPException, LDAPBindError, LDAPPasswordIsMandatoryError
 from slugify import slugify
+from flask import g, has_app_context
+from ldap_pool import LdapConnectionPool
+from ldap_cache import DirectoryCache
+from ldap_batch import WriteBatch, WriteStep
+from replica import DirectoryReplica
+from membership_index import MembershipIndex
+from invalidation import InvalidationBus
+from models import User, Group
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pyasn1.type import univ, namedtype, tag
+import threading
+import metrics
 import config
 
 USER_ATTRIBUTES = ['uid', 'cn', 'mail']
 GROUP_ATTRIBUTES = ['ou', 'cn', 'businessCategory', 'mail']
 GROUP_ATTRIBUTES_SPECIAL = ['ou', 'cn', 'owner', 'member', 'mail']
 GROUP_ATTRIBUTES_PENDING = ['ou', 'cn', 'owner', 'member', 'pending', 'mail']
+# member is left out on purpose, the member lists of big groups are huge
+GROUP_ATTRIBUTES_MEMBERSHIP = GROUP_ATTRIBUTES + ['owner', 'pending']
+MEMBERSHIP_ATTRIBUTES = ['uid', 'memberOf']
+
+# Maximum number of uids combined into one OR filter
+DN_BATCH_SIZE = 100
+
+PAGED_RESULTS_CONTROL = '1.2.840.113556.1.4.319'
+SORT_CONTROL = '1.2.840.113556.1.4.473'
+VLV_CONTROL = '2.16.840.1.113730.3.4.9'
+# uid and ou have no ORDERING rule in the core schema, the sort names one
+SORT_ORDERING_RULE = 'caseIgnoreOrderingMatch'
+
+# Result code of an add whose DN exists already
+ENTRY_ALREADY_EXISTS = 68
+# How often create_guest picks another uid when a concurrent add took it
+USERNAME_RETRIES = 5
 
 class LdapApiException(Exception):
     pass
 
+# Server Side Sorting (RFC 2891) and Virtual List View (draft-ietf-ldapext-ldapv3-vlv)
+# requests, ldap3 has no helpers for them
+
+class SortKey(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('attributeType', univ.OctetString()),
+        namedtype.OptionalNamedType('orderingRule', univ.OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 0))),
+    )
+
+class SortKeyList(univ.SequenceOf):
+    componentType = SortKey()
+
+def sort_control(attribute):
+    key = SortKey()
+    key['attributeType'] = attribute
+    key['orderingRule'] = SORT_ORDERING_RULE
+    keys = SortKeyList()
+    keys.append(key)
+    # critical, so a server that can't sort says so instead of returning any entries
+    return build_control(SORT_CONTROL, True, keys)
+
+class VlvOffset(univ.Sequence):
+    tagSet = univ.Sequence.tagSet.tagImplicitly(tag.Tag(tag.tagClassContext, tag.tagFormatConstructed, 0))
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('offset', univ.Integer()),
+        namedtype.NamedType('contentCount', univ.Integer()),
+    )
+
+class VlvTarget(univ.Choice):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('byOffset', VlvOffset()),
+        namedtype.NamedType('greaterThanOrEqual', univ.OctetString().subtype(implicitTag=tag.Tag(tag.tagClassContext, tag.tagFormatSimple, 1))),
+    )
+
+class VlvRequest(univ.Sequence):
+    componentType = namedtype.NamedTypes(
+        namedtype.NamedType('beforeCount', univ.Integer()),
+        namedtype.NamedType('afterCount', univ.Integer()),
+        namedtype.NamedType('target', VlvTarget()),
+    )
+
+def vlv_control(after, count):
+    """ Asks for count entries of the sorted list, starting at the first one whose
+    sort key is >= after, compared with the ordering rule of the sort (or at the
+    first entry if after is None). """
+    target = VlvTarget()
+    if after is None:
+        offset = VlvOffset()
+        offset['offset'] = 1
+        offset['contentCount'] = 0
+        target['byOffset'] = offset
+    else:
+        target['greaterThanOrEqual'] = after
+    request = VlvRequest()
+    request['beforeCount'] = 0
+    request['afterCount'] = count - 1
+    request['target'] = target
+    return build_control(VLV_CONTROL, True, request)
+
 class LdapApi():
     def __init__(self, config):
         self.config = config
         self.server = Server(config.LDAP_HOST, port=config.LDAP_PORT, allowed_referral_hosts=[('*', True)])
-        self.conn = Connection(self.server, config.BIND_DN, config.BIND_PW, auto_bind=True)
-        self.conn.bind()
+        self.client_strategy = getattr(config, 'LDAP_CLIENT_STRATEGY', SYNC)
+        self.pool = LdapConnectionPool(
+            self.create_connection,
+            min_size=getattr(config, 'LDAP_POOL_MIN_SIZE', 1),
+            max_size=getattr(config, 'LDAP_POOL_MAX_SIZE', 10),
+            idle_timeout=getattr(config, 'LDAP_POOL_IDLE_TIMEOUT', 300),
+        )
+        self.cache = DirectoryCache(
+            ttl=getattr(config, 'LDAP_CACHE_TTL', 30),
+            max_size=getattr(config, 'LDAP_CACHE_SIZE', 10000),
+        )
+        # Connections that bind as a user to check their password. They are
+        # rebound on every use and never used for anything else.
+        self.auth_pool = LdapConnectionPool(
+            self.create_auth_connection,
+            min_size=0,
+            max_size=getattr(config, 'LDAP_AUTH_POOL_MAX_SIZE', 5),
+            idle_timeout=getattr(config, 'LDAP_POOL_IDLE_TIMEOUT', 300),
+            require_bound=False,
+        )
+        self.page_size = getattr(config, 'LDAP_PAGE_SIZE', 500)
+        self.count_lock = threading.Lock()
+        self.suffix = getattr(config, 'LDAP_SUFFIX', 'dc=sog')
+        self.replica = None
+        if getattr(config, 'LDAP_REPLICA', False):
+            self.replica = DirectoryReplica(
+                self, USER_ATTRIBUTES, GROUP_ATTRIBUTES,
+                poll_interval=getattr(config, 'LDAP_REPLICA_POLL_INTERVAL', 5),
+                reload_interval=getattr(config, 'LDAP_REPLICA_RELOAD_INTERVAL', 600),
+            )
+        # tells the other worker processes what this one wrote
+        self.bus = None
+        if getattr(config, 'LDAP_INVALIDATION_DIR', None):
+            self.bus = InvalidationBus(config.LDAP_INVALIDATION_DIR, self.handle_invalidation)
+        self.index = None
+        if getattr(config, 'LDAP_MEMBERSHIP_INDEX', False):
+            # the index authorizes owners, without the bus it wouldn't see the
+            # writes of other workers until the next reload
+            if self.bus is None:
+                raise LdapApiException('LDAP_MEMBERSHIP_INDEX needs LDAP_INVALIDATION_DIR')
+            self.index = MembershipIndex(self, reload_interval=getattr(config, 'LDAP_MEMBERSHIP_INDEX_RELOAD_INTERVAL', 60))
+        metrics.watch_pool('default', self.pool)
+        metrics.watch_pool('auth', self.auth_pool)
+        metrics.watch_cache(self.cache)
+        # runs the steps of a WriteBatch, each step borrows its own connection
+        self.executor = ThreadPoolExecutor(max_workers=self.pool.max_size, thread_name_prefix='ldap-write')
         print("Connected to LDAP server!")
 
-    def get_connection(self):
-        if self.conn.closed:
-            self.conn = Connection(self.server, self.config.BIND_DN, self.config.BIND_PW, auto_bind=True)
-            self.conn.bind()
-            print("Re-connected to LDAP server!")
-        return self.conn
+    def create_connection(self):
+        conn = Connection(self.server, self.config.BIND_DN, self.config.BIND_PW, client_strategy=self.client_strategy, auto_bind=True)
+        conn.bind()
+        return conn
+
+    def create_auth_connection(self):
+        # only ever rebound as a user, so it is opened without binding as the service account
+        conn = Connection(self.server, client_strategy=self.client_strategy)
+        conn.open(read_server_info=False)
+        return conn
+
+    # Every operation borrows a connection from the pool and returns it
+    # afterwards, so results must be taken from the connection before that.
+
+    @contextmanager
+    def operation(self, name):
+        """ Borrows a connection for one LDAP operation and records how long the operation took. """
+        self.count_operation()
+        with self.pool.connection() as conn, metrics.LDAP_OPERATIONS.time(operation=name):
+            yield conn
+
+    def count_operation(self):
+        """ Counts the LDAP operations of the current request in g.ldap_operations. """
+        if not has_app_context():
+            return
+        # the steps of a WriteBatch count from executor threads
+        with self.count_lock:
+            g.ldap_operations = g.get('ldap_operations', 0) + 1
+
+    def model_for(self, base):
+        """ Entries below DN_PEOPLE are returned as User, below DN_GROUPS as Group
+        and everything else as ldap3 Entry. """
+        base = base.lower()
+        if base == self.config.DN_PEOPLE.lower() or self.is_dn_below(base, self.config.DN_PEOPLE):
+            return User
+        if base == self.config.DN_GROUPS.lower() or self.is_dn_below(base, self.config.DN_GROUPS):
+            return Group
+        return None
+
+    def results(self, conn, model):
+        if model is None:
+            return conn.entries
+        return [model.from_response(x) for x in conn.response if x['type'] == 'searchResEntry']
+
+    def search(self, base, search_filter, attributes=None, **kwargs):
+        with self.operation('search') as conn:
+            conn.search(base, search_filter, attributes=attributes, **kwargs)
+            if not conn.response:
+                return []
+            return self.results(conn, self.model_for(base))
+
+    def paged_search(self, base, search_filter, attributes=None):
+        """ Yields the entries of a search page by page, using the Simple Paged Results
+        control. The connection is held until the generator is exhausted or closed.
+        """
+        # counted as one operation however many pages it takes, only the pages are timed
+        self.count_operation()
+        model = self.model_for(base)
+        with self.pool.connection() as conn:
+            cookie = None
+            while True:
+                with metrics.LDAP_OPERATIONS.time(operation='search'):
+                    conn.search(base, search_filter, attributes=attributes, paged_size=self.page_size, paged_cookie=cookie)
+                if conn.response:
+                    yield from self.results(conn, model)
+                cookie = conn.result.get('controls', {}).get(PAGED_RESULTS_CONTROL, {}).get('value', {}).get('cookie')
+                if not cookie:
+                    break
+
+    def sorted_search(self, base, search_filter, key, after=None, limit=None, attributes=None):
+        """ Returns up to limit entries of the search whose key attribute comes after
+        the value after (all if it is None), ordered by key ignoring case.
+        uid and ou have no ORDERING rule in the core schema, so after can't go into
+        the filter. Instead the server sorts with an explicit ordering rule and
+        returns the window of the list starting at after (Virtual List View, the
+        sssvlv overlay), one page is a single search however far into the list it
+        is. If the server can't do that, all entries are read with a paged search
+        and sorted here.
+        """
+        entries = None
+        if limit is not None:
+            # the window starts at the entry named by after, if it still exists
+            count = limit + 1 if after is not None else limit
+            with self.operation('search') as conn:
+                conn.search(base, search_filter, attributes=attributes, controls=[sort_control(key), vlv_control(after, count)])
+                if conn.result['result'] == 0:
+                    entries = self.results(conn, self.model_for(base)) if conn.response else []
+        if entries is None:
+            entries = sorted(self.paged_search(base, search_filter, attributes=attributes), key=lambda x: str(x[key]).lower())
+        if after is not None:
+            entries = [x for x in entries if str(x[key]).lower() > after.lower()]
+        return entries[:limit]
+
+    def modify(self, dn, changes):
+        with self.operation('modify') as conn:
+            conn.modify(dn, changes)
+            result = conn.result
+        if result['result'] == 0 and self.is_dn_below(dn, self.config.DN_GROUPS):
+            ou = dn.split(',')[0].split('=', 1)[1]
+            if self.index is not None:
+                self.index.apply(ou, changes)
+            if self.replica is not None:
+                self.replica.apply_group(ou, changes)
+        return result
+
+    def modify_dn(self, dn, relative_dn, new_superior=None):
+        with self.operation('modify_dn') as conn:
+            conn.modify_dn(dn, relative_dn, new_superior=new_superior)
+            result = conn.result
+        if result['result'] == 0:
+            new_dn = '%s,%s' % (relative_dn, new_superior or dn.split(',', 1)[1])
+            if self.index is not None:
+                self.index.rename_user(dn, new_dn)
+            if self.replica is not None:
+                self.replica.rename_user(dn, new_dn)
+        return result
+
+    def add(self, dn, object_class, attributes):
+        with self.operation('add') as conn:
+            conn.add(dn, object_class, attributes)
+            return conn.result
+
+    def delete(self, dn):
+        with self.operation('delete') as conn:
+            conn.delete(dn)
+            result = conn.result
+        if self.index is not None and result['result'] == 0:
+            self.index.remove_user(dn)
+        return result
+
+    def search_one(self, base, search_filter, attributes=None):
+        entries = self.search(base, search_filter, attributes=attributes)
+        if len(entries) > 0:
+            return entries[0]
+        return None
+
+    # Cache: lookups by uid or ou are cached. Misses (None) are not, a user or
+    # group created elsewhere is found right away. Every write has to invalidate the user or group it touches. The
+    # invalidation is published to the other worker processes, which
+    # invalidate it in their caches too (handle_invalidation).
+
+    def subscribe(self):
+        if self.bus is not None:
+            self.bus.start()
+
+    def cached(self, key, load):
+        self.subscribe()
+        found, value = self.cache.get(key)
+        if not found:
+            generation = self.cache.generation
+            value = load()
+            if value is not None:
+                self.cache.put(key, value, generation)
+        return value
+
+    def invalidate_user(self, uid, publish=True):
+        self.cache.invalidate(('user', uid.lower()), ('active_user', uid.lower()), ('inactive_user', uid.lower()))
+        if self.replica is not None:
+            self.replica.refresh_user(uid)
+        if publish and self.bus is not None:
+            self.bus.publish('user', uid)
+
+    def invalidate_group(self, group, publish=True):
+        self.cache.invalidate(('group', group.lower()), ('group_owners', group.lower()))
+        if publish and self.bus is not None:
+            self.bus.publish('group', group)
+
+    def handle_invalidation(self, kind, key):
+        """ Called for the invalidations published by other worker processes. """
+        if not isinstance(key, str):
+            return
+        if kind == 'user':
+            self.invalidate_user(key, publish=False)
+        elif kind == 'group':
+            self.invalidate_group(key, publish=False)
+            # the writes of this process are applied to these as they happen
+            if self.index is not None:
+                self.index.refresh_group(key)
+            if self.replica is not None:
+                self.replica.refresh_group(key)
+
+    def replicated(self):
+        """ Returns the replica if reads are served from it. """
+        self.subscribe()
+        if self.replica is not None and self.replica.loaded:
+            return self.replica
+        return None
+
+    def indexed(self):
+        """ Returns the membership index if membership questions are answered by it. """
+        self.subscribe()
+        if self.index is not None and self.index.loaded:
+            return self.index
+        return None
 
     def get_group_dn(self, ou):
         return 'ou='+ou+','+self.config.DN_GROUPS
@@ -42,7 +365,10 @@ class LdapApi():
     def dn_to_uid(self, dn):
         return dn.split(',')[0][4:]
 
-    def generate_username(self, name):
+    def generate_username(self, name, taken=()):
+        """ Returns the first free uid of uid, uid2, uid3, ... for the name.
+        The uids in taken are skipped as well.
+        """
         uid = slugify(name, separator='.', replacements=
                       [
                           ["ü", "ue"],
@@ -51,71 +377,166 @@ class LdapApi():
                           ["ß", "ss"],
                       ]
                       )
+        # all candidates start with uid, so one prefix search finds every one in use
+        entries = self.search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s*))' % escape_filter_chars(uid), attributes=['uid'])
+        existing = set(x.lower() for entry in entries for x in entry.uid.values)
+        existing.update(x.lower() for x in taken)
         check = uid
         index = 2
-        exists = True
-        while(exists):
-            exists = self.get_connection().search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % check)
-            if exists:
-                check = uid + str(index)
-                index += 1
+        while check in existing:
+            check = uid + str(index)
+            index += 1
         return check
 
+    # uid -> DN lookups are memoized for the duration of a request, writes
+    # that move or delete a user update the memo via remember_user_dn.
+
+    def dn_memo(self):
+        if not has_app_context():
+            return None
+        if 'ldap_dn_memo' not in g:
+            g.ldap_dn_memo = {}
+        return g.ldap_dn_memo
+
+    def remember_user_dn(self, uid, dn):
+        memo = self.dn_memo()
+        if memo is not None:
+            memo[uid.lower()] = dn
+
+    def forget_user_dn(self, uid):
+        memo = self.dn_memo()
+        if memo is not None:
+            memo.pop(uid.lower(), None)
+
+    def is_dn_below(self, dn, base):
+        return dn.lower().endswith(',' + base.lower())
+
     def find_user_dn(self, uid):
-        print("Finding user dn of " + uid)
-        return self.get_user(uid).entry_dn
+        memo = self.dn_memo()
+        if memo is not None and uid.lower() in memo:
+            dn = memo[uid.lower()]
+        else:
+            print("Finding user dn of " + uid)
+            try:
+                dn = self.get_user(uid).entry_dn
+            except LdapApiException:
+                dn = None
+            self.remember_user_dn(uid, dn)
+        if dn is None:
+            raise LdapApiException('Cannot find user %s' % uid)
+        return dn
 
     def find_inactive_user_dn(self, uid):
-        return self.get_inactive_user(uid).entry_dn
+        memo = self.dn_memo()
+        if memo is not None and uid.lower() in memo:
+            dn = memo[uid.lower()]
+            if dn is None or not self.is_dn_below(dn, self.config.DN_PEOPLE_INACTIVE):
+                raise LdapApiException('Cannot find user %s' % uid)
+            return dn
+        dn = self.get_inactive_user(uid).entry_dn
+        self.remember_user_dn(uid, dn)
+        return dn
+
+    def get_directory_version(self):
+        """ Returns the contextCSN of the suffix, which the syncprov overlay updates
+        on every write, or None if the server doesn't provide it.
+        """
+        entries = self.search(self.suffix, '(objectClass=*)', attributes=['contextCSN'], search_scope=BASE)
+        if not entries or 'contextCSN' not in entries[0]:
+            return None
+        return ' '.join(sorted(entries[0].contextCSN.values))
 
     def get_groups(self):
-        self.get_connection().search(self.config.DN_GROUPS, '(objectClass=groupOfNames)', attributes=GROUP_ATTRIBUTES)
-        return self.get_connection().entries
+        return list(self.iter_groups())
+
+    def iter_groups(self):
+        return self.paged_search(self.config.DN_GROUPS, '(objectClass=groupOfNames)', attributes=GROUP_ATTRIBUTES)
+
+    def get_groups_page(self, after, limit):
+        """ Returns up to limit groups ordered by ou, starting after the ou after (or at the first). """
+        return self.sorted_search(self.config.DN_GROUPS, '(objectClass=groupOfNames)', 'ou', after, limit, attributes=GROUP_ATTRIBUTES)
     
     def get_group(self, uid):
-        self.get_connection().search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % uid, attributes=GROUP_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        replica = self.replicated()
+        if replica is not None:
+            entry = replica.get_group(uid)
+        else:
+            entry = self.cached(('group', uid.lower()), lambda: self.search_one(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % uid, attributes=GROUP_ATTRIBUTES))
+        if entry is not None:
+            return entry
         else:
             raise LdapApiException('Cannot find user %s' % uid)
 
     # Users
 
     def get_users(self):
-        self.get_connection().search(config.DN_PEOPLE_ACTIVE, '(objectClass=inetOrgPerson)', attributes=USER_ATTRIBUTES)
-        return self.get_connection().entries
+        return list(self.iter_users())
+
+    def iter_users(self):
+        return self.paged_search(config.DN_PEOPLE_ACTIVE, '(objectClass=inetOrgPerson)', attributes=USER_ATTRIBUTES)
+
+    def get_users_page(self, after, limit):
+        """ Returns up to limit users ordered by uid, starting after the uid after (or at the first). """
+        return self.sorted_search(config.DN_PEOPLE_ACTIVE, '(objectClass=inetOrgPerson)', 'uid', after, limit, attributes=USER_ATTRIBUTES)
 
     def get_user(self, uid):
-        self.get_connection().search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        replica = self.replicated()
+        if replica is not None:
+            entry = replica.get_user(uid)
+        else:
+            entry = self.cached(('user', uid.lower()), lambda: self.search_one(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES))
+        if entry is not None:
+            return entry
         else:
             raise LdapApiException('Cannot find user %s' % uid)
 
     def get_active_user(self, uid):
-        self.get_connection().search(config.DN_PEOPLE_ACTIVE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        replica = self.replicated()
+        if replica is not None:
+            entry = replica.get_user(uid, config.DN_PEOPLE_ACTIVE)
+        else:
+            entry = self.cached(('active_user', uid.lower()), lambda: self.search_one(config.DN_PEOPLE_ACTIVE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES))
+        if entry is not None:
+            return entry
         else:
             raise LdapApiException('Cannot find user %s' % uid)
 
     def get_inactive_user(self, uid):
-        self.get_connection().search(config.DN_PEOPLE_INACTIVE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        replica = self.replicated()
+        if replica is not None:
+            entry = replica.get_user(uid, config.DN_PEOPLE_INACTIVE)
+        else:
+            entry = self.cached(('inactive_user', uid.lower()), lambda: self.search_one(config.DN_PEOPLE_INACTIVE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES))
+        if entry is not None:
+            return entry
         else:
             raise LdapApiException('Cannot find user %s' % uid)
 
     def is_active(self, uid):
-        self.get_connection().search(config.DN_PEOPLE_ACTIVE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=USER_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
+        memo = self.dn_memo()
+        if memo is not None and uid.lower() in memo:
+            dn = memo[uid.lower()]
+            return dn is not None and self.is_dn_below(dn, self.config.DN_PEOPLE_ACTIVE)
+        try:
+            self.get_active_user(uid)
             return True
-        return False
+        except LdapApiException:
+            return False
+
+    def get_user_memberships(self, uid):
+        """ Returns the entry of a user (active, inactive or guest) with the groups
+        it is member of in memberOf. """
+        entry = self.search_one(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=MEMBERSHIP_ATTRIBUTES)
+        self.remember_user_dn(uid, entry.entry_dn if entry is not None else None)
+        if entry is not None:
+            return entry
+        else:
+            raise LdapApiException('Cannot find user %s' % uid)
 
     def get_user_by_alternative_mail(self, alternative_mail):
-        self.get_connection().search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(mail-alternative=%s))' % alternative_mail, attributes=USER_ATTRIBUTES)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        entries = self.search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(mail-alternative=%s))' % alternative_mail, attributes=USER_ATTRIBUTES)
+        if len(entries) > 0:
+            return entries[0]
         else:
             raise LdapApiException('Cannot find user with  %s' % alternative_mail)
 
@@ -130,137 +551,312 @@ class LdapApi():
             'givenName',
             'mailEnabled'
         ]
-        self.get_connection().search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=detailed_user_attributes)
-        if len(self.get_connection().entries) > 0:
-            return self.get_connection().entries[0]
+        entries = self.search(config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)(uid=%s))' % uid, attributes=detailed_user_attributes)
+        if len(entries) > 0:
+            return entries[0]
         else:
             raise LdapApiException('Cannot find user %s' % uid)
 
+    def get_users_by_uids(self, uids, base):
+        """ Looks up many users below base, combining up to DN_BATCH_SIZE uids into
+        a single search. Returns a dict of lowercased uid -> entry.
+        """
+        found = {}
+        for i in range(0, len(uids), DN_BATCH_SIZE):
+            chunk = uids[i:i + DN_BATCH_SIZE]
+            uid_filter = ''.join('(uid=%s)' % escape_filter_chars(uid) for uid in chunk)
+            entries = self.search(base, '(&(objectClass=inetOrgPerson)(|%s))' % uid_filter, attributes=USER_ATTRIBUTES)
+            for entry in entries:
+                found.setdefault(str(entry.uid).lower(), entry)
+        return found
+
+    def get_users_by_dns(self, dns, base):
+        """ Looks up the users referenced by a list of DNs (e.g. the owners of a group)
+        below base, combining up to DN_BATCH_SIZE of them into a single search.
+        Returns the users in the order of dns, DNs that cannot be found are skipped.
+        """
+        uids = [self.dn_to_uid(dn) for dn in dns]
+        found = self.get_users_by_uids(uids, base)
+        users = []
+        for dn, uid in zip(dns, uids):
+            if uid.lower() in found:
+                users.append(found[uid.lower()])
+            else:
+                # this happens
+                print(dn, "does not exist")
+        return users
+
     def create_guest(self, name, mail):
-        uid = self.generate_username('guest.' + name)
-        dn = self.get_guest_dn(uid)
-        self.get_connection().add(dn, [
-            'inetOrgPerson',
-            'top',
-        ], {
-            'uid': uid,
-            'displayName': '%s' % name,
-            'cn': '%s' % name,
-            'givenName': '%s' % name.split(" ")[0],
-            'sn': '%s' % name.split(" ")[0],
-            'mail': mail
-        })
-        if self.get_connection().result['result'] != 0:
-            raise RuntimeError(self.get_connection().result)
+        taken = set()
+        for _ in range(USERNAME_RETRIES):
+            uid = self.generate_username('guest.' + name, taken)
+            dn = self.get_guest_dn(uid)
+            result = self.add(dn, [
+                'inetOrgPerson',
+                'top',
+            ], {
+                'uid': uid,
+                'displayName': '%s' % name,
+                'cn': '%s' % name,
+                'givenName': '%s' % name.split(" ")[0],
+                'sn': '%s' % name.split(" ")[0],
+                'mail': mail
+            })
+            if result['result'] != ENTRY_ALREADY_EXISTS:
+                break
+            # another request created the same uid since we searched
+            taken.add(uid)
+        self.invalidate_user(uid)
+        if result['result'] != 0:
+            raise RuntimeError(result)
+        self.remember_user_dn(uid, dn)
         return uid
 
+    # Lifecycle operations touch many groups. The affected groups are looked up
+    # first, then the modifies are run as a WriteBatch: concurrently and undone
+    # again if one of them fails (raising LdapBatchException).
+
+    def modify_step(self, dn, changes):
+        """ Returns a WriteStep for a modify that only adds or deletes values. """
+        inverse = {MODIFY_ADD: MODIFY_DELETE, MODIFY_DELETE: MODIFY_ADD}
+        undo = dict((attribute, [(inverse[operation], values) for operation, values in operations]) for attribute, operations in changes.items())
+        return WriteStep('modify %s' % dn, lambda: self.modify(dn, changes), lambda: self.modify(dn, undo))
+
     def activate_user(self, uid):
-        old_dn = self.get_inactive_person_dn(uid)
-        pending_groups = self.get_groups_as_inactive_pending_member(uid)
-        for group in pending_groups:
-            self.remove_group_inactive_pending_member(str(group.ou), uid)
-        self.get_connection().modify_dn(old_dn, 'uid=%s' % uid, new_superior=self.config.DN_PEOPLE_ACTIVE)
-        for group in pending_groups:
-            self.add_group_active_pending_member(str(group.ou), uid)
-        self.add_group_member("allgemein", uid)
+        old_dn = self.find_inactive_user_dn(uid)
+        new_dn = self.get_active_person_dn(uid)
+        pending_groups = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % escape_filter_chars(old_dn), attributes=['ou'])
+        batch = WriteBatch(self.executor)
+        try:
+            batch.run([self.modify_step(group.entry_dn, {'pending': [(MODIFY_DELETE, [old_dn])]}) for group in pending_groups])
+            batch.run([WriteStep(
+                'move %s' % old_dn,
+                lambda: self.modify_dn(old_dn, 'uid=%s' % uid, new_superior=self.config.DN_PEOPLE_ACTIVE),
+                lambda: self.modify_dn(new_dn, 'uid=%s' % uid, new_superior=self.config.DN_PEOPLE_INACTIVE),
+            )])
+            batch.run([self.modify_step(group.entry_dn, {'pending': [(MODIFY_ADD, [new_dn])]}) for group in pending_groups] +
+                      [self.modify_step(self.get_group_dn("allgemein"), {'member': [(MODIFY_ADD, [new_dn])]})])
+        except Exception:
+            self.forget_user_dn(uid)
+            raise
+        else:
+            self.remember_user_dn(uid, new_dn)
+        finally:
+            self.invalidate_user(uid)
+            for group in pending_groups:
+                self.invalidate_group(str(group.ou))
+            self.invalidate_group("allgemein")
 
     def delete_user(self, uid):
         dn = self.find_user_dn(uid)
-        groups = self.get_groups_as_member(uid)
-        for group in groups:
-            self.remove_group_member(str(group.ou), uid)
-        owned_groups = self.get_groups_as_owner(uid)
-        for group in owned_groups:
-            self.remove_group_owner(str(group.ou), uid)
-        self.get_connection().delete(dn)
+        # memberOf may be stale, the groups are searched for the user's DN
+        member_groups = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(member=%s))' % escape_filter_chars(dn), attributes=['ou'])
+        owned_groups = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(owner=%s))' % escape_filter_chars(dn), attributes=['ou'])
+        steps = [self.modify_step(group.entry_dn, {'member': [(MODIFY_DELETE, [dn])]}) for group in member_groups]
+        steps += [self.modify_step(group.entry_dn, {'owner': [(MODIFY_DELETE, [dn])]}) for group in owned_groups]
+        batch = WriteBatch(self.executor)
+        try:
+            batch.run(steps)
+            batch.run([WriteStep('delete %s' % dn, lambda: self.delete(dn))])
+        finally:
+            self.invalidate_user(uid)
+            for ou in set(str(group.ou) for group in member_groups + owned_groups):
+                self.invalidate_group(ou)
+        self.remember_user_dn(uid, None)
 
     def add_user_mail_alias(self, uid, mail):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(user_dn, {'mailAlias': [(MODIFY_ADD, [mail])]})
+        self.modify(user_dn, {'mailAlias': [(MODIFY_ADD, [mail])]})
+        self.invalidate_user(uid)
 
     def remove_user_mail_alias(self, uid, mail):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(user_dn, {'mailAlias': [(MODIFY_DELETE, [mail])]})
+        self.modify(user_dn, {'mailAlias': [(MODIFY_DELETE, [mail])]})
+        self.invalidate_user(uid)
 
     def set_user_mail(self, uid, mail):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(user_dn, {'mail-alternative': [(MODIFY_REPLACE, [mail])]})
+        self.modify(user_dn, {'mail-alternative': [(MODIFY_REPLACE, [mail])]})
+        self.invalidate_user(uid)
 
     def set_user_password(self, uid, password):
         user_dn = self.find_user_dn(uid)
         hashed_pw = hashed(HASHED_SALTED_SHA, password)
-        self.get_connection().modify(user_dn, {'userPassword': [(MODIFY_REPLACE, [hashed_pw])]})
+        self.modify(user_dn, {'userPassword': [(MODIFY_REPLACE, [hashed_pw])]})
+        self.invalidate_user(uid)
 
     def set_user_alternative_mail(self, uid, alternative_mail):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(user_dn, {'mail-alternative': [(MODIFY_REPLACE, [alternative_mail])]})
+        self.modify(user_dn, {'mail-alternative': [(MODIFY_REPLACE, [alternative_mail])]})
+        self.invalidate_user(uid)
 
     def check_user_password(self, uid, password):
         successful = False
         inactive = None
         try:
-            try:
-                user_dn = self.find_user_dn(uid)
-                inactive = False
-            except LdapApiException as e:
-                user_dn = self.find_inactive_user_dn(uid)
-                inactive = True
-            new_server = Server(config.LDAP_HOST, port=config.LDAP_PORT, allowed_referral_hosts=[('*', True)])
-            new_conn = Connection(new_server, user_dn, password, auto_bind=True)
-            new_conn.bind()
-            new_conn.unbind()
+            # people below DN_PEOPLE are found with one search, the DN tells whether they are inactive
+            user_dn = self.find_user_dn(uid)
+            inactive = self.is_dn_below(user_dn, config.DN_PEOPLE_INACTIVE)
+            # rebind keeps the password of the last bind when it gets none
+            if not isinstance(password, str) or not password:
+                return False, inactive
+            self.count_operation()
+            with self.auth_pool.connection() as conn, metrics.LDAP_OPERATIONS.time(operation='bind'):
+                try:
+                    if not conn.rebind(user=user_dn, password=password, read_server_info=False):
+                        raise LDAPBindError('Invalid credentials for %s' % user_dn)
+                finally:
+                    self.unbind_user(conn)
             successful = True
-        except (LDAPBindError, LdapApiException) as e:
+        except (LDAPBindError, LDAPPasswordIsMandatoryError, LdapApiException) as e:
             print(e)
             successful = False
             pass
         return successful, inactive
 
+    def unbind_user(self, conn):
+        """ Binds the auth connection anonymously again, so neither the user's
+        password nor their identity stay with it while it is idle. """
+        conn.authentication = ANONYMOUS
+        conn.user = None
+        conn.password = None
+        self.count_operation()
+        try:
+            conn.bind(read_server_info=False)
+        except LDAPException as e:
+            # possibly still bound as the user, it must not go back to the pool
+            print("Error: Could not bind anonymously: %s" % e)
+            conn.unbind()
+
+    # Groups: bulk changes
+
+    def modify_group_users(self, group, uids, changes):
+        """ Applies changes, a list of (attribute, operation) like ('member', MODIFY_ADD),
+        for many users at once. All DNs go into one multi-valued modify, only if that
+        fails (e.g. because one user already is a member) the users are modified one
+        by one to find out which of them failed. Returns a dict uid -> "ok" or error.
+        """
+        group_dn = self.get_group_dn(group)
+        found = self.get_users_by_uids(uids, self.config.DN_PEOPLE)
+        results = {}
+        dns = {}
+        firsts = {}  # uid in lower case -> as first given
+        duplicates = {}
+        for uid in uids:
+            # uids are case-insensitive, a DN twice in one modify fails it
+            if uid.lower() in firsts:
+                duplicates[uid] = firsts[uid.lower()]
+                continue
+            firsts[uid.lower()] = uid
+            if uid.lower() in found:
+                dns[uid] = found[uid.lower()].entry_dn
+                self.remember_user_dn(uid, dns[uid])
+            else:
+                results[uid] = "not found"
+        if dns:
+            result = self.modify(group_dn, dict((attribute, [(operation, list(dns.values()))]) for attribute, operation in changes))
+            if result['result'] == 0:
+                results.update((uid, "ok") for uid in dns)
+            else:
+                for uid, dn in dns.items():
+                    result = self.modify(group_dn, dict((attribute, [(operation, [dn])]) for attribute, operation in changes))
+                    results[uid] = "ok" if result['result'] == 0 else result['description']
+            self.invalidate_group(group)
+        for uid, first in duplicates.items():
+            results[uid] = results[first]
+        return results
+
+    def add_group_members(self, group, uids):
+        return self.modify_group_users(group, uids, [('member', MODIFY_ADD)])
+
+    def accept_group_pending_members(self, group, uids):
+        return self.modify_group_users(group, uids, [('pending', MODIFY_DELETE), ('member', MODIFY_ADD)])
+
+    def remove_group_pending_members(self, group, uids):
+        return self.modify_group_users(group, uids, [('pending', MODIFY_DELETE)])
+
+    def add_group_owners(self, ou, uids):
+        results = self.modify_group_users(ou, uids, [('owner', MODIFY_ADD)])
+        group = self.get_group(ou)
+        if 'mail' in group.entry_attributes:
+            for uid in uids:
+                if results[uid] == "ok":
+                    self.add_user_mail_alias(uid, str(group.mail))
+        return results
+
+    # Groups: membership tests, answered by the membership index when it is enabled
+
+    def has_group_role(self, group, user_dn, role):
+        """ Whether the user has the role (member, owner or pending) in the group. """
+        index = self.indexed()
+        if index is not None:
+            return index.has_role(user_dn, group, role)
+        entries = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s)(%s=%s))' % (group, role, escape_filter_chars(user_dn)), attributes=['ou'], size_limit=1)
+        return len(entries) > 0
+
+    def user_has_group_role(self, group, uid, role, bases):
+        try:
+            user_dn = self.find_user_dn(uid)
+        except LdapApiException:
+            return False
+        if not any(self.is_dn_below(user_dn, base) for base in bases):
+            return False
+        return self.has_group_role(group, user_dn, role)
+
+    def is_group_member(self, group, uid):
+        """ Whether uid is an active member or a guest of the group. """
+        return self.user_has_group_role(group, uid, 'member', [config.DN_PEOPLE_ACTIVE, config.DN_PEOPLE_GUESTS])
+
+    def is_group_active_pending_member(self, group, uid):
+        return self.user_has_group_role(group, uid, 'pending', [config.DN_PEOPLE_ACTIVE])
+
+    def is_group_inactive_pending_member(self, group, uid):
+        return self.user_has_group_role(group, uid, 'pending', [config.DN_PEOPLE_INACTIVE])
+
     # Groups: pending
+    def get_groups_with_membership(self, user_dn):
+        """ Returns all groups the user is pending in, member or owner of with
+        a single search. owner and pending are included to tell the roles apart. """
+        user_dn = escape_filter_chars(user_dn)
+        return self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(|(pending=%s)(member=%s)(owner=%s)))' % (user_dn, user_dn, user_dn), attributes=GROUP_ATTRIBUTES_MEMBERSHIP)
+
     def get_groups_as_active_pending_member(self, uid):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % user_dn, attributes=GROUP_ATTRIBUTES_PENDING)
-        return self.get_connection().entries
+        return self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % user_dn, attributes=GROUP_ATTRIBUTES_PENDING)
 
     def get_groups_as_inactive_pending_member(self, uid):
         user_dn = self.find_inactive_user_dn(uid)
-        self.get_connection().search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % user_dn, attributes=GROUP_ATTRIBUTES_PENDING)
-        return self.get_connection().entries
+        return self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % user_dn, attributes=GROUP_ATTRIBUTES_PENDING)
+
+    def get_pending_group_owners(self, user_dn):
+        """ Returns the owner DNs of the groups the user is pending in as {ou: [owner DNs]}. """
+        index = self.indexed()
+        if index is not None:
+            return index.get_role_group_owners(user_dn, 'pending')
+        entries = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(pending=%s))' % escape_filter_chars(user_dn), attributes=['ou', 'owner'])
+        return dict((str(entry.ou), list(entry.owner.values) if 'owner' in entry else []) for entry in entries)
 
     def add_group_active_pending_member(self, group, uid):
         group_dn = self.get_group_dn(group)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'pending': [(MODIFY_ADD, [user_dn])]})
+        self.modify(group_dn, {'pending': [(MODIFY_ADD, [user_dn])]})
+        self.invalidate_group(group)
 
     def get_group_active_pending_members(self, group):
-        self.get_connection().search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_PENDING)
-        if len(self.get_connection().entries):
-            group_members = []
-            if not "pending" in self.get_connection().entries[0]:
+        entries = self.search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_PENDING)
+        if len(entries):
+            if not "pending" in entries[0]:
                 return []
-            for dn in self.get_connection().entries[0].pending.values:
-                try:
-                    group_members.append(self.get_active_user(self.dn_to_uid(dn)))
-                # this happens
-                except LdapApiException:
-                    print(dn, "does not exist")
-            return group_members
+            return self.get_users_by_dns(entries[0].pending.values, config.DN_PEOPLE_ACTIVE)
         else:
             raise LdapApiException('Cannot find group %s' % group)
 
     def get_group_inactive_pending_members(self, group):
-        self.get_connection().search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_PENDING)
-        if len(self.get_connection().entries):
-            group_members = []
-            if not "pending" in self.get_connection().entries[0]:
+        entries = self.search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_PENDING)
+        if len(entries):
+            if not "pending" in entries[0]:
                 return []
-            for dn in self.get_connection().entries[0].pending.values:
-                try:
-                    group_members.append(self.get_inactive_user(self.dn_to_uid(dn)))
-                # this happens
-                except LdapApiException:
-                    print(dn, "does not exist")
-            return group_members
+            return self.get_users_by_dns(entries[0].pending.values, config.DN_PEOPLE_INACTIVE)
         else:
             raise LdapApiException('Cannot find group %s' % group)
 
@@ -268,81 +864,111 @@ class LdapApi():
     def remove_group_active_pending_member(self, group, uid):
         group_dn = self.get_group_dn(group)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'pending': [(MODIFY_DELETE, [user_dn])]})
+        self.modify(group_dn, {'pending': [(MODIFY_DELETE, [user_dn])]})
+        self.invalidate_group(group)
 
     def remove_group_inactive_pending_member(self, group, uid):
         group_dn = self.get_group_dn(group)
         user_dn = self.find_inactive_user_dn(uid)
-        self.get_connection().modify(group_dn, {'pending': [(MODIFY_DELETE, [user_dn])]})
+        self.modify(group_dn, {'pending': [(MODIFY_DELETE, [user_dn])]})
+        self.invalidate_group(group)
 
     # Groups: member
 
     def get_groups_as_member(self, uid):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(member=%s))' % user_dn, attributes=GROUP_ATTRIBUTES)
-        return self.get_connection().entries
+        replica = self.replicated()
+        if replica is not None:
+            return replica.get_groups_as_member(user_dn)
+        return self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(member=%s))' % user_dn, attributes=GROUP_ATTRIBUTES)
 
     def add_group_member(self, group, uid):
         group_dn = self.get_group_dn(group)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]})
+        self.modify(group_dn, {'member': [(MODIFY_ADD, [user_dn])]})
+        self.invalidate_group(group)
 
     def get_group_members(self, group):
+        replica = self.replicated()
+        if replica is not None:
+            return replica.get_group_users(group, config.DN_PEOPLE_ACTIVE)
         group_dn = self.get_group_dn(group)
-        self.get_connection().search(config.DN_PEOPLE_ACTIVE, '(&(objectClass=inetOrgPerson)(memberOf=%s))' % group_dn, attributes=USER_ATTRIBUTES)
-        return self.get_connection().entries
+        return self.search(config.DN_PEOPLE_ACTIVE, '(&(objectClass=inetOrgPerson)(memberOf=%s))' % group_dn, attributes=USER_ATTRIBUTES)
 
     def get_group_guests(self, group):
+        replica = self.replicated()
+        if replica is not None:
+            return replica.get_group_users(group, config.DN_PEOPLE_GUESTS)
         group_dn = self.get_group_dn(group)
-        self.get_connection().search(config.DN_PEOPLE_GUESTS, '(&(objectClass=inetOrgPerson)(memberOf=%s))' % group_dn, attributes=USER_ATTRIBUTES)
-        return self.get_connection().entries
+        return self.search(config.DN_PEOPLE_GUESTS, '(&(objectClass=inetOrgPerson)(memberOf=%s))' % group_dn, attributes=USER_ATTRIBUTES)
 
     def remove_group_member(self, group, uid):
         group_dn = self.get_group_dn(group)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'member': [(MODIFY_DELETE, [user_dn])]})
+        self.modify(group_dn, {'member': [(MODIFY_DELETE, [user_dn])]})
+        self.invalidate_group(group)
 
     # Groups: owner
 
     def get_groups_as_owner(self, uid):
         user_dn = self.find_user_dn(uid)
-        self.get_connection().search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(owner=%s))' % user_dn, attributes=GROUP_ATTRIBUTES)
-        return self.get_connection().entries
+        return self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(owner=%s))' % user_dn, attributes=GROUP_ATTRIBUTES)
+
+    def get_owned_group_ous(self, user_dn):
+        index = self.indexed()
+        if index is not None:
+            return index.get_group_ous(user_dn, 'owner')
+        entries = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(owner=%s))' % escape_filter_chars(user_dn), attributes=['ou'])
+        return [str(entry.ou) for entry in entries]
 
     def add_group_owner(self, ou, uid):
         group_dn = self.get_group_dn(ou)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'owner': [(MODIFY_ADD, [user_dn])]})
+        self.modify(group_dn, {'owner': [(MODIFY_ADD, [user_dn])]})
+        self.invalidate_group(ou)
         group = self.get_group(ou)
         if 'mail' in group.entry_attributes:
             self.add_user_mail_alias(uid, str(group.mail))
 
     def get_group_owners(self, group):
-        self.get_connection().search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_SPECIAL)
-        if len(self.get_connection().entries):
-            group_owners = []
-            for dn in self.get_connection().entries[0].owner.values:
-                try:
-                    group_owners.append(self.get_user(self.dn_to_uid(dn)))
-                # this happens
-                except LdapApiException:
-                    print(dn, "does not exist")
-            return group_owners
+        owners = self.cached(('group_owners', group.lower()), lambda: self.load_group_owners(group))
+        if owners is not None:
+            return owners
         else:
             raise LdapApiException('Cannot find group %s' % group)
 
+    def load_group_owners(self, group):
+        entries = self.search(config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % group, attributes=GROUP_ATTRIBUTES_SPECIAL)
+        if len(entries):
+            return self.get_users_by_dns(entries[0].owner.values, config.DN_PEOPLE)
+        return None
+
+    def get_group_owner_uids(self, group):
+        index = self.indexed()
+        if index is not None:
+            # owners may be deleted users, only those that still exist count
+            owners = self.get_users_by_dns(index.get_group_users(group, 'owner'), config.DN_PEOPLE)
+        else:
+            owners = self.get_group_owners(group)
+        return [str(x.uid) for x in owners]
+
     def is_group_owner_anywhere(self, uid):
-        self.get_connection().search(self.config.DN_GROUPS, '(objectClass=groupOfNames)', attributes=["owner"])
-        for entry in self.get_connection().entries:
-            for owner in entry.owner:
-                if self.dn_to_uid(owner) == uid:
-                    return True
-        return False
+        try:
+            user_dn = self.find_user_dn(uid)
+        except LdapApiException:
+            return False
+        index = self.indexed()
+        if index is not None:
+            return index.has_any_group(user_dn, 'owner')
+        # owner is indexed, one matching group is enough
+        entries = self.search(self.config.DN_GROUPS, '(&(objectClass=groupOfNames)(owner=%s))' % escape_filter_chars(user_dn), attributes=['ou'], size_limit=1)
+        return len(entries) > 0
 
     def remove_group_owner(self, ou, uid):
         group_dn = self.get_group_dn(ou)
         user_dn = self.find_user_dn(uid)
-        self.get_connection().modify(group_dn, {'owner': [(MODIFY_DELETE, [user_dn])]})
+        self.modify(group_dn, {'owner': [(MODIFY_DELETE, [user_dn])]})
+        self.invalidate_group(ou)
         group = self.get_group(ou)
         if 'mail' in group.entry_attributes:
             self.remove_user_mail_alias(uid, str(group.mail))
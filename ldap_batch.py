@@ -0,0 +1,57 @@
+import contextvars
+
+# Planned directory writes for operations that touch many entries at once
+# (activating or deleting a user). The steps of a phase run concurrently,
+# every step that succeeded is written to a compensation log. If a step
+# fails, the logged steps are undone in reverse order.
+
+# attributeOrValueExists on add and noSuchAttribute on delete mean the entry
+# is already in the state the step wants, there is nothing to undo then
+ALREADY_DONE = [16, 20]
+
+class LdapBatchException(Exception):
+    pass
+
+class WriteStep():
+    def __init__(self, description, apply, undo=None):
+        """ apply and undo are called without arguments and return an ldap3 result dict. """
+        self.description = description
+        self.apply = apply
+        self.undo = undo
+
+class WriteBatch():
+    def __init__(self, executor):
+        self.executor = executor
+        self.log = []
+
+    def run(self, steps):
+        """ Runs the steps of one phase concurrently. Raises LdapBatchException
+        after undoing all previous steps if one of them fails. """
+        # the steps run in the caller's context, so they see the same flask g
+        futures = [(step, self.executor.submit(contextvars.copy_context().run, step.apply)) for step in steps]
+        failed = []
+        for step, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append('%s: %s' % (step.description, e))
+                continue
+            if result['result'] == 0:
+                self.log.append(step)
+            elif result['result'] not in ALREADY_DONE:
+                failed.append('%s: %s' % (step.description, result['description']))
+        if failed:
+            self.rollback()
+            raise LdapBatchException('; '.join(failed))
+
+    def rollback(self):
+        while self.log:
+            step = self.log.pop()
+            if step.undo is None:
+                continue
+            try:
+                result = step.undo()
+                if result['result'] != 0:
+                    print("Could not undo", step.description, result['description'])
+            except Exception as e:
+                print("Could not undo", step.description, e)
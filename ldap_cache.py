@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Process-local cache for directory entries.
+# Entries expire after ttl seconds, the least recently used entries are
+# evicted once max_size is reached. Keys are tuples like ('user', uid),
+# writes to the directory have to invalidate the affected keys.
+# Every invalidation increments generation. A value loaded before an
+# invalidation isn't stored, it may be older than what was invalidated.
+
+class DirectoryCache():
+    def __init__(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key):
+        """ Returns a tuple (found, value). """
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, item[1]
+            if item is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, generation=None):
+        """ Stores the value unless generation, read before loading it, is outdated. """
+        if not self.enabled:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,152 @@
+import threading
+import time
+from contextlib import contextmanager
+from ldap3 import BASE
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError
+
+# A bounded pool of ldap3 connections.
+# ldap3 connections with the SYNC strategy keep the result of the last
+# operation on the connection object itself, so a connection must only be
+# used by one thread at a time. The pool hands out one connection per
+# operation and takes it back afterwards.
+
+class LdapPoolExhausted(Exception):
+    pass
+
+class LdapConnectionPool():
+    def __init__(self, factory, min_size=1, max_size=10, idle_timeout=300, health_check_interval=60, acquire_timeout=10, require_bound=True):
+        """ factory is called without arguments and must return a bound connection.
+        At least min_size connections are kept open, at most max_size are handed out
+        at the same time. Connections that were idle for longer than idle_timeout
+        seconds are closed, those idle for longer than health_check_interval seconds
+        are probed before they are handed out again. Pools whose users rebind
+        every connection they borrow pass require_bound=False, a failed bind
+        leaves the connection unbound but still usable.
+        """
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.require_bound = require_bound
+        self.size = 0
+        self.in_use = 0
+        self.idle = []  # stack of (connection, released_at), most recently used last
+        self.lock = threading.Condition()
+        for _ in range(min_size):
+            self.idle.append((self.factory(), time.monotonic()))
+            self.size += 1
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            candidate = None
+            exhausted = False
+            with self.lock:
+                stale = self.reap()
+                while True:
+                    if self.idle:
+                        # counted as in use while it is probed outside of the lock
+                        candidate = self.idle.pop()
+                        self.in_use += 1
+                        break
+                    if self.size < self.max_size:
+                        # reserve the slot, connect outside of the lock
+                        self.size += 1
+                        self.in_use += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        exhausted = True
+                        break
+                    self.lock.wait(remaining)
+            for conn in stale:
+                self.discard(conn)
+            if exhausted:
+                raise LdapPoolExhausted('No LDAP connection available after %s seconds' % self.acquire_timeout)
+            if candidate is None:
+                break
+            conn, released_at = candidate
+            if self.is_healthy(conn, released_at):
+                return conn
+            with self.lock:
+                self.size -= 1
+                self.in_use -= 1
+                self.lock.notify()
+            self.discard(conn)
+        try:
+            return self.factory()
+        except Exception:
+            with self.lock:
+                self.size -= 1
+                self.in_use -= 1
+                self.lock.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        broken = broken or conn.closed
+        with self.lock:
+            self.in_use -= 1
+            if broken:
+                self.size -= 1
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.lock.notify()
+        if broken:
+            self.discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except LDAPCommunicationError:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def is_healthy(self, conn, released_at):
+        if conn.closed or (self.require_bound and not conn.bound):
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+        # The server may have dropped the connection while it was idle
+        try:
+            conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['1.1'])
+        except LDAPException:
+            return False
+        return not conn.closed
+
+    def reap(self):
+        """ Takes the connections that have been idle for too long out of the pool
+        and returns them, to be discarded after the lock is released. Must be called
+        with the lock held. """
+        now = time.monotonic()
+        stale = []
+        # the stack is ordered by release time, the oldest connections are at the bottom
+        while self.idle and self.size > self.min_size and now - self.idle[0][1] > self.idle_timeout:
+            conn, _ = self.idle.pop(0)
+            self.size -= 1
+            stale.append(conn)
+        return stale
+
+    def discard(self, conn):
+        """ Closes a connection that has been taken out of the pool. Unbinding may
+        block, so the lock must not be held. """
+        try:
+            conn.unbind()
+        except LDAPException:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+            self.size -= len(idle)
+        for conn, _ in idle:
+            self.discard(conn)
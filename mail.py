@@ -1,6 +1,12 @@
 import smtplib, ssl
-import _thread
+import atexit
+import os
+import queue
+import threading
+import time
 import config
+import metrics
+from background import PerProcess
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
@@ -9,6 +15,175 @@ from email.utils import make_msgid, formatdate
 context = ssl.create_default_context()
 port = 587
 
+# Mails are delivered in the background: compose_and_send puts them into a
+# bounded queue that is drained by worker threads. Every worker keeps its
+# own authenticated SMTP session open and reuses it for the next message.
+
+class Outbox():
+    def __init__(self, workers=2, max_size=1000, max_retries=3, backoff=2, idle_timeout=60):
+        self.worker_count = workers
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.process = PerProcess(self.spawn)
+        self.queue = None
+        self.workers = []
+
+    def start(self):
+        self.process.start()
+
+    def spawn(self):
+        self.queue = queue.Queue(maxsize=self.max_size)
+        self.workers = []
+        for i in range(self.worker_count):
+            worker = threading.Thread(target=self.work, name='mail-outbox-%d' % i, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, to_email, message):
+        self.start()
+        try:
+            self.queue.put_nowait((to_email, message))
+        except queue.Full:
+            print("Error: Mail outbox is full, sending synchronously")
+            self.disconnect(self.deliver(None, to_email, message))
+
+    def work(self):
+        server = None
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                server = self.disconnect(server)
+                continue
+            if item is None:
+                self.disconnect(server)
+                self.queue.task_done()
+                return
+            try:
+                server = self.deliver(server, *item)
+            except Exception as e:
+                # e.g. UnicodeEncodeError for a non-ASCII recipient, the worker must survive it
+                print("Error: Could not send email to %s: %s" % (item[0], e))
+                server = self.disconnect(server)
+            finally:
+                self.queue.task_done()
+
+    def deliver(self, server, to_email, message):
+        """ Sends one message, reconnecting and retrying on temporary failures.
+        Returns the SMTP session to use for the next message. """
+        for attempt in range(self.max_retries + 1):
+            try:
+                if server is None:
+                    server = self.connect()
+                self.send(server, to_email, message)
+                return server
+            except smtplib.SMTPRecipientsRefused as e:
+                print("Error: Could not send email to %s: %s" % (to_email, e))
+                return server
+            except smtplib.SMTPResponseException as e:
+                # only 4xx replies are worth a retry
+                if e.smtp_code < 400 or e.smtp_code >= 500:
+                    print("Error: Could not send email to %s: %s" % (to_email, e))
+                    return server
+                print("Error: SMTP server answered %s" % e)
+                server = self.disconnect(server)
+            except (smtplib.SMTPException, OSError) as e:
+                print("Error: SMTP session failed: %s" % e)
+                server = self.disconnect(server)
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        print("Error: Could not send email to %s" % to_email)
+        return server
+
+    def send(self, server, to_email, message):
+        started = time.perf_counter()
+        result = 'error'
+        try:
+            server.sendmail(config.MAIL_ADDRESS, to_email, message.as_string())
+            result = 'ok'
+        finally:
+            metrics.SMTP_SENDS.observe(time.perf_counter() - started, result=result)
+
+    def connect(self):
+        server = smtplib.SMTP(config.MAIL_SERVER, port)
+        server.starttls(context=context)
+        server.login(config.MAIL_ADDRESS, config.MAIL_PASSWORD)
+        return server
+
+    def disconnect(self, server):
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+    def flush(self, timeout=30):
+        """ Delivers all queued mails and stops the workers. """
+        if not self.process.reset():
+            return
+        for _ in self.workers:
+            self.queue.put(None)
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+outbox = Outbox(
+    workers=getattr(config, 'MAIL_OUTBOX_WORKERS', 2),
+    max_size=getattr(config, 'MAIL_OUTBOX_SIZE', 1000),
+    max_retries=getattr(config, 'MAIL_MAX_RETRIES', 3),
+)
+atexit.register(outbox.flush)
+metrics.watch_outbox(outbox)
+
+# Templates are read once and kept in memory. A file is read again when its
+# modification time changes, this is checked at most once per check_interval.
+
+class TemplateCache():
+    def __init__(self, check_interval=1):
+        self.check_interval = check_interval
+        self.items = {}  # key -> (checked_at, mtimes, value)
+        self.lock = threading.Lock()
+
+    def get(self, key, paths, build):
+        """ Returns build(*paths), built again only if one of the files changed. """
+        now = time.monotonic()
+        item = self.items.get(key)
+        if item is not None and now - item[0] < self.check_interval:
+            return item[2]
+        mtimes = tuple(os.stat(path).st_mtime_ns for path in paths)
+        if item is None or item[1] != mtimes:
+            value = build(*paths)
+        else:
+            value = item[2]
+        with self.lock:
+            self.items[key] = (now, mtimes, value)
+        return value
+
+templates = TemplateCache()
+
+CONTENT_MARKER = '\0content\0'
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+def build_layout(meta_path, style_path):
+    # Fill in the style once and split the meta-template around the content
+    html = read_file(meta_path).format(content=CONTENT_MARKER, style=read_file(style_path))
+    return tuple(html.split(CONTENT_MARKER))
+
+def build_logo(path):
+    with open(path, 'rb') as logo_file:
+        logo = MIMEImage(logo_file.read())
+    logo.add_header('Content-ID', '<logo_sog>')
+    return logo
+
+def get_template(path):
+    return templates.get(path, (path,), read_file)
+
 def compose_and_send(to_email, subject, text, html=None):
     if (html is not None):
         message = MIMEMultipart("related")
@@ -28,53 +203,31 @@ def compose_and_send(to_email, subject, text, html=None):
         message_alt.attach(text_part)
         html_part = MIMEText(html, "html")
         message_alt.attach(html_part)
-        logo_file = open('emails/logo_sog.png', 'rb')
-        logo = MIMEImage(logo_file.read())
-        logo_file.close()
-        logo.add_header('Content-ID', '<logo_sog>')
-        message.attach(logo)
+        # The encoded logo part is shared by all messages
+        message.attach(templates.get('logo', ('emails/logo_sog.png',), build_logo))
 
-    try:
-        with smtplib.SMTP(config.MAIL_SERVER, port) as server:
-            server.starttls(context=context)
-            server.login(config.MAIL_ADDRESS, config.MAIL_PASSWORD)
-            server.sendmail(config.MAIL_ADDRESS, to_email, message.as_string())
-    except:
-        print ("Error: Could not send email")
+    outbox.put(to_email, message)
 
 def send_email(to_email, subject, file_name, replacements):
     try:
-        htmlfile = open('emails/meta-template.html')
-        html = htmlfile.read()
-        htmlfile.close()
-
-        contentfile = open(file_name + '.html')
-        content = contentfile.read()
-        contentfile.close()
-
-        stylefile = open('emails/style.css')
-        style = stylefile.read()
-        stylefile.close()
-        
-        # Add content-template & styling to meta-template
-        html = html.format(content=content.format(**replacements), style=style)
+        layout_start, layout_end = templates.get('layout', ('emails/meta-template.html', 'emails/style.css'), build_layout)
+        content = get_template(file_name + '.html')
+
+        # Add content-template to the meta-template that already contains the styling
+        html = layout_start + content.format(**replacements) + layout_end
     except Exception as e:
         print(e)
         print("Error: Could not parse html mail template. Trying to send plain text mail instead")
         html = None
     
     try:
-        textfile = open(file_name + '.txt')
-        text = textfile.read()
-        textfile.close()
-        text = text.format(**replacements)
+        text = get_template(file_name + '.txt').format(**replacements)
     except Exception as e:
         print(e)
         print ("Error: Could not parse text mail template")
     else:
         try:
-            # _thread.start_new_thread(compose_and_send, (to_email, subject, text, html,))
             compose_and_send(to_email, subject, text, html)
         except Exception as e:
             print(e)
-            print("Error: Could not spawn sendmail thread")
+            print("Error: Could not queue email")
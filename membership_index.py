@@ -0,0 +1,193 @@
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.utils.conv import escape_filter_chars
+from background import Periodic
+import threading
+import time
+
+# Who is member, owner or pending in which group, kept in memory when
+# LDAP_MEMBERSHIP_INDEX is enabled.
+#
+# Every group gets a small integer id. For each role the index keeps one
+# bitset (a Python int) per user DN with the bits of the groups the user has
+# that role in, and for each group the DNs having the role. "Is X owner of G"
+# is a bit test, "which groups does X own" walks the set bits, "who owns the
+# groups X is pending in" reads the owners of the groups in X's pending bitset.
+#
+# A background thread loads all groups with one paged search and again every
+# reload_interval seconds. Writes made through LdapApi are applied right away
+# (apply, rename_user, remove_user), groups written by other worker processes
+# are read again (refresh_group), other changes show up with the next load.
+# Until the first load has finished, LdapApi asks LDAP as before.
+
+ROLES = ('member', 'owner', 'pending')
+
+class MembershipIndex():
+    def __init__(self, api, reload_interval=60):
+        self.api = api
+        self.reload_interval = reload_interval
+        self.lock = threading.RLock()
+        self.ids = {}  # ou -> group id
+        self.ous = []  # group id -> ou as in the directory
+        self.bits = dict((role, {}) for role in ROLES)  # role -> user DN -> bitset of group ids
+        self.users = dict((role, []) for role in ROLES)  # role -> group id -> {user DN: DN as in the directory}
+        self.changes = None  # writes applied while loading, replayed on the new index
+        self.loaded_at = None
+        self.thread = Periodic('ldap-membership-index', self.load, lambda: self.reload_interval, 'Could not load the membership index')
+
+    @property
+    def loaded(self):
+        self.thread.start()
+        return self.loaded_at is not None
+
+    def stop(self):
+        self.thread.stop()
+
+    # Loading
+
+    def load(self):
+        started = time.monotonic()
+        with self.lock:
+            self.changes = []
+        try:
+            index = MembershipIndex(self.api)
+            entries = self.api.paged_search(self.api.config.DN_GROUPS, '(objectClass=groupOfNames)', attributes=['ou'] + list(ROLES))
+            for entry in entries:
+                gid = index.group_id(str(entry.ou))
+                for role in ROLES:
+                    if role in entry:
+                        index.add(gid, role, entry[role].values)
+            with self.lock:
+                for change in self.changes:
+                    change(index)
+                self.ids = index.ids
+                self.ous = index.ous
+                self.bits = index.bits
+                self.users = index.users
+                self.loaded_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.changes = None
+        print("Loaded membership index with %d groups in %.1f s" % (len(self.ous), time.monotonic() - started))
+
+    def group_id(self, ou):
+        """ Must be called with the lock held. """
+        gid = self.ids.get(ou.lower())
+        if gid is None:
+            gid = self.ids[ou.lower()] = len(self.ous)
+            self.ous.append(ou)
+            for role in ROLES:
+                self.users[role].append({})
+        return gid
+
+    def add(self, gid, role, dns):
+        bits = self.bits[role]
+        users = self.users[role][gid]
+        for dn in dns:
+            users[dn.lower()] = dn
+            bits[dn.lower()] = bits.get(dn.lower(), 0) | (1 << gid)
+
+    def remove(self, gid, role, dns):
+        bits = self.bits[role]
+        users = self.users[role][gid]
+        for dn in dns:
+            users.pop(dn.lower(), None)
+            mask = bits.get(dn.lower(), 0) & ~(1 << gid)
+            if mask:
+                bits[dn.lower()] = mask
+            else:
+                bits.pop(dn.lower(), None)
+
+    # Changes, called by LdapApi after a successful write
+
+    def change(self, update):
+        with self.lock:
+            update(self)
+            if self.changes is not None:
+                self.changes.append(update)
+
+    def apply(self, ou, changes):
+        """ Applies the changes of a modify of the group, in the format of
+        Connection.modify. Attributes other than the roles are ignored. """
+        def update(index):
+            gid = index.group_id(ou)
+            for role, operations in changes.items():
+                if role.lower() not in ROLES:
+                    continue
+                role = role.lower()
+                for operation, values in operations:
+                    if operation == MODIFY_ADD:
+                        index.add(gid, role, values)
+                    elif operation == MODIFY_DELETE:
+                        # deleting without values removes the attribute
+                        index.remove(gid, role, values or list(index.users[role][gid].values()))
+                    elif operation == MODIFY_REPLACE:
+                        index.remove(gid, role, list(index.users[role][gid].values()))
+                        index.add(gid, role, values)
+        self.change(update)
+
+    def rename_user(self, old_dn, new_dn):
+        def update(index):
+            for role in ROLES:
+                for gid in index.group_ids(old_dn, role):
+                    index.remove(gid, role, [old_dn])
+                    index.add(gid, role, [new_dn])
+        self.change(update)
+
+    def refresh_group(self, ou):
+        """ Reads the group again, after another process wrote to it. """
+        if self.loaded_at is None:
+            return
+        entries = list(self.api.paged_search(self.api.config.DN_GROUPS, '(&(objectClass=groupOfNames)(ou=%s))' % escape_filter_chars(ou), attributes=['ou'] + list(ROLES)))
+        def update(index):
+            gid = index.group_id(ou)
+            for role in ROLES:
+                index.remove(gid, role, list(index.users[role][gid].values()))
+                if entries and role in entries[0]:
+                    index.add(gid, role, entries[0][role].values)
+        self.change(update)
+
+    def remove_user(self, dn):
+        def update(index):
+            for role in ROLES:
+                for gid in index.group_ids(dn, role):
+                    index.remove(gid, role, [dn])
+        self.change(update)
+
+    # Reads
+
+    def group_ids(self, user_dn, role):
+        mask = self.bits[role].get(user_dn.lower(), 0)
+        gids = []
+        while mask:
+            low = mask & -mask
+            gids.append(low.bit_length() - 1)
+            mask ^= low
+        return gids
+
+    def has_role(self, user_dn, ou, role):
+        with self.lock:
+            gid = self.ids.get(ou.lower())
+            return gid is not None and (self.bits[role].get(user_dn.lower(), 0) >> gid) & 1 == 1
+
+    def has_any_group(self, user_dn, role):
+        with self.lock:
+            return user_dn.lower() in self.bits[role]
+
+    def get_group_ous(self, user_dn, role):
+        with self.lock:
+            return [self.ous[gid] for gid in self.group_ids(user_dn, role)]
+
+    def get_role_group_owners(self, user_dn, role):
+        """ The owners of the groups in which the user has the role, e.g. the
+        owners of the groups the user is pending in, as {ou: [owner DNs]}. """
+        with self.lock:
+            owners = self.users['owner']
+            return dict((self.ous[gid], list(owners[gid].values())) for gid in self.group_ids(user_dn, role))
+
+    def get_group_users(self, ou, role):
+        """ The DNs having the role in the group. """
+        with self.lock:
+            gid = self.ids.get(ou.lower())
+            if gid is None:
+                return []
+            return list(self.users[role][gid].values())
@@ -0,0 +1,144 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Metrics in the Prometheus text format, served on /metrics.
+# Every process keeps its own values, with several gunicorn workers a scrape
+# only sees the worker that answered it.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs]
+    return '{' + ','.join('%s="%s"' % pair for pair in escaped) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram():
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}  # label values -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[x] for x in self.labels)
+        with self.lock:
+            item = self.values.get(key)
+            if item is None:
+                item = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    item[0][i] += 1
+            item[1] += value
+            item[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', format_labels(self.labels, key, [('le', format_value(bound))]), bucket_count))
+                samples.append((self.name + '_sum', format_labels(self.labels, key), total))
+                samples.append((self.name + '_count', format_labels(self.labels, key), count))
+        return samples
+
+class Gauge():
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=()):
+        """ The values are read when the metrics are rendered, every watched
+        object registers a function returning its current value. """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collectors = {}
+        self.lock = threading.Lock()
+
+    def watch(self, collect, **labels):
+        key = tuple(labels[x] for x in self.labels)
+        with self.lock:
+            self.collectors[key] = collect
+
+    def samples(self):
+        with self.lock:
+            collectors = sorted(self.collectors.items())
+        return [(self.name, format_labels(self.labels, key), collect()) for key, collect in collectors]
+
+class CollectedCounter(Gauge):
+    """ A counter kept by another object, e.g. the hits of the cache. """
+    type = 'counter'
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for name, labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Histogram('vogelnest_http_request_duration_seconds', 'Time spent answering requests', ['endpoint', 'method', 'status']))
+LDAP_OPERATIONS = registry.register(Histogram('vogelnest_ldap_operation_duration_seconds', 'Time spent in LDAP operations', ['operation']))
+SMTP_SENDS = registry.register(Histogram('vogelnest_smtp_send_duration_seconds', 'Time spent sending mails via SMTP', ['result']))
+
+POOL_SIZE = registry.register(Gauge('vogelnest_ldap_pool_connections', 'Open LDAP connections', ['pool']))
+POOL_IN_USE = registry.register(Gauge('vogelnest_ldap_pool_connections_in_use', 'LDAP connections currently handed out', ['pool']))
+POOL_MAX_SIZE = registry.register(Gauge('vogelnest_ldap_pool_max_connections', 'Maximum number of LDAP connections', ['pool']))
+CACHE_SIZE = registry.register(Gauge('vogelnest_ldap_cache_entries', 'Entries in the directory cache'))
+CACHE_HITS = registry.register(CollectedCounter('vogelnest_ldap_cache_hits_total', 'Directory cache hits'))
+CACHE_MISSES = registry.register(CollectedCounter('vogelnest_ldap_cache_misses_total', 'Directory cache misses'))
+CACHE_HIT_RATIO = registry.register(Gauge('vogelnest_ldap_cache_hit_ratio', 'Share of directory cache lookups that were hits'))
+OUTBOX_DEPTH = registry.register(Gauge('vogelnest_mail_outbox_queue_depth', 'Mails waiting to be sent'))
+
+def watch_pool(name, pool):
+    POOL_SIZE.watch(lambda: pool.size, pool=name)
+    POOL_IN_USE.watch(lambda: pool.in_use, pool=name)
+    POOL_MAX_SIZE.watch(lambda: pool.max_size, pool=name)
+
+def hit_ratio(cache):
+    stats = cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    return stats['hits'] / lookups if lookups else 0.0
+
+def watch_cache(cache):
+    CACHE_SIZE.watch(lambda: cache.stats()['size'])
+    CACHE_HITS.watch(lambda: cache.stats()['hits'])
+    CACHE_MISSES.watch(lambda: cache.stats()['misses'])
+    CACHE_HIT_RATIO.watch(lambda: hit_ratio(cache))
+
+def watch_outbox(outbox):
+    OUTBOX_DEPTH.watch(lambda: outbox.queue.qsize() if outbox.queue is not None else 0)
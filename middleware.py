@@ -4,6 +4,9 @@ from ldap3.utils import conv
 import io
 import token_handler
 
+# The uid from the bearer token, verified once per request by the middleware
+UID_ENVIRON_KEY = 'vogelnest.uid'
+
 # Middleware for sanitizing every input
 
 class middleware():
@@ -14,9 +17,10 @@ class middleware():
         authheader = request.headers.get('Authorization')
 
         uid = token_handler.get_jwt_user(authheader)
+        environ[UID_ENVIRON_KEY] = uid
         print(request.url.replace(request.url_root, ""))
         if uid == None and \
-                not request.url.replace(request.url_root, "") in ["login", "users/reset_password", "users/set_password_with_key"] and \
+                not request.url.replace(request.url_root, "") in ["login", "users/reset_password", "users/set_password_with_key", "metrics"] and \
                 not request.url.replace(request.url_root, "").startswith("confirm"): 
             res = Response(u'Authorization failed', mimetype= 'text/plain', status=401)
             return res(environ, start_response)
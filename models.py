@@ -0,0 +1,112 @@
+import sys
+
+# Lightweight value types for the users and groups LdapApi returns.
+# An ldap3 Entry keeps its cursor, the attribute definitions and raw and
+# decoded copies of every value. A User or Group keeps the DN and one tuple
+# per attribute in slots. They are used like ldap3 entries: entry.uid.value,
+# entry.member.values, str(entry.cn), 'mail' in entry, entry.entry_dn.
+
+# Attributes whose values are DNs. DNs are interned, a user in many groups is stored once.
+DN_ATTRIBUTES = frozenset(['member', 'owner', 'pending', 'memberof'])
+
+class Values(tuple):
+    """ The values of one attribute, used like an ldap3 Attribute. """
+    __slots__ = ()
+
+    @property
+    def values(self):
+        return self
+
+    @property
+    def value(self):
+        if not self:
+            return None
+        return self[0] if len(self) == 1 else list(self)
+
+    def __str__(self):
+        return str(self[0]) if len(self) == 1 else str(list(self))
+
+    def __repr__(self):
+        return 'Values(%s)' % str(self)
+
+    def __eq__(self, other):
+        # like ldap3, an attribute equals its value
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = tuple.__hash__
+
+class Model():
+    __slots__ = ('entry_dn',)
+    ATTRIBUTES = ()  # the LDAP names of the attributes, a slot each
+
+    @classmethod
+    def slot(cls, name):
+        return cls.SLOTS.get(name.lower())
+
+    @classmethod
+    def from_response(cls, item):
+        """ Builds the model from one searchResEntry of conn.response, without
+        the ldap3 Entry in between. Attributes the model doesn't know are left out. """
+        obj = cls.__new__(cls)
+        obj.entry_dn = sys.intern(item['dn'])
+        for key, values in item['attributes'].items():
+            slot = cls.slot(key)
+            if slot is None:
+                continue
+            # attributes that are single-valued in the schema come as plain values
+            if not isinstance(values, list):
+                values = [values]
+            if key.lower() in DN_ATTRIBUTES:
+                values = [sys.intern(x) for x in values]
+            setattr(obj, slot, Values(values))
+        return obj
+
+    def project(self, attributes):
+        """ Returns a copy with only the given attributes, the values are shared. """
+        obj = self.__class__.__new__(self.__class__)
+        obj.entry_dn = self.entry_dn
+        for name in attributes:
+            slot = self.slot(name)
+            if slot is not None and hasattr(self, slot):
+                setattr(obj, slot, getattr(self, slot))
+        return obj
+
+    def attribute_items(self):
+        """ Yields (LDAP name, values) of the attributes the entry has. """
+        for name in self.ATTRIBUTES:
+            values = getattr(self, self.slot(name), None)
+            if values is not None:
+                yield name, values
+
+    @property
+    def entry_attributes(self):
+        return [name for name, _ in self.attribute_items()]
+
+    def __contains__(self, name):
+        slot = self.slot(name)
+        return slot is not None and hasattr(self, slot)
+
+    def __getitem__(self, name):
+        slot = self.slot(name)
+        if slot is None:
+            raise KeyError(name)
+        return getattr(self, slot)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.entry_dn)
+
+def slots(attributes):
+    return tuple(name.replace('-', '_') for name in attributes)
+
+class User(Model):
+    ATTRIBUTES = ('uid', 'cn', 'sn', 'givenName', 'displayName', 'mail', 'mail-alternative', 'mailEnabled', 'memberOf', 'entryCSN')
+    SLOTS = dict((name.lower(), slot) for name, slot in zip(ATTRIBUTES, slots(ATTRIBUTES)))
+    __slots__ = slots(ATTRIBUTES)
+
+class Group(Model):
+    ATTRIBUTES = ('ou', 'cn', 'businessCategory', 'mail', 'owner', 'member', 'pending', 'entryCSN')
+    SLOTS = dict((name.lower(), slot) for name, slot in zip(ATTRIBUTES, slots(ATTRIBUTES)))
+    __slots__ = slots(ATTRIBUTES)
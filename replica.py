@@ -0,0 +1,234 @@
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from ldap3.utils.conv import escape_filter_chars
+from background import Periodic
+import threading
+import time
+
+# In-memory copy of the people and groups subtrees, read instead of LDAP when
+# LDAP_REPLICA is enabled.
+#
+# ldap3 has no syncrepl consumer, so the replica follows the directory by
+# polling: every poll_interval seconds a background thread reads the
+# contextCSN of the suffix and, if it changed, fetches the entries with a
+# newer entryCSN. Deletions of other writers can't be seen that way, they
+# disappear with the full reload every reload_interval seconds. Writes made
+# through LdapApi are applied right away (apply_group, rename_user,
+# refresh_user), so a request always reads its own writes. Groups written by
+# other worker processes are read again (refresh_group).
+#
+# Until the first load has finished, reads go to LDAP as before.
+
+class DirectoryReplica():
+    def __init__(self, api, user_attributes, group_attributes, poll_interval=5, reload_interval=600):
+        """ Users and groups are kept with the given attributes, the same the
+        API reads from LDAP. """
+        self.api = api
+        self.user_attributes = user_attributes
+        self.group_attributes = group_attributes
+        self.poll_interval = poll_interval
+        self.reload_interval = reload_interval
+        self.lock = threading.RLock()
+        self.users = {}  # uid -> User
+        self.groups = {}  # ou -> Group without member
+        self.members = {}  # ou -> tuple of member DNs
+        self.member_of = {}  # user DN -> set of ous
+        self.csn = None  # newest entryCSN seen
+        self.version = None  # contextCSN at the last load
+        self.loaded_at = None
+        self.thread = Periodic('ldap-replica', self.poll, lambda: self.poll_interval, 'Could not refresh the directory replica')
+
+    @property
+    def loaded(self):
+        self.thread.start()
+        return self.loaded_at is not None
+
+    def stop(self):
+        self.thread.stop()
+
+    def poll(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.reload_interval:
+            self.load()
+            return
+        version = self.api.get_directory_version()
+        if version is None or version == self.version:
+            return
+        if self.csn is None:
+            self.load()
+        else:
+            self.load_changes(version)
+
+    # Loading
+
+    def search_users(self, search_filter):
+        return self.api.paged_search(self.api.config.DN_PEOPLE, '(&(objectClass=inetOrgPerson)%s)' % search_filter, attributes=self.user_attributes + ['entryCSN'])
+
+    def search_groups(self, search_filter):
+        return self.api.paged_search(self.api.config.DN_GROUPS, '(&(objectClass=groupOfNames)%s)' % search_filter, attributes=self.group_attributes + ['member', 'entryCSN'])
+
+    def load(self):
+        started = time.monotonic()
+        # read before the entries, changes made while loading are fetched by the next poll
+        version = self.api.get_directory_version()
+        users = {}
+        groups = {}
+        members = {}
+        member_of = {}
+        csn = None
+        for entry in self.search_users(''):
+            csn = max_csn(csn, entry)
+            users[str(entry.uid).lower()] = entry.project(self.user_attributes)
+        for entry in self.search_groups(''):
+            csn = max_csn(csn, entry)
+            ou = str(entry.ou).lower()
+            groups[ou] = entry.project(self.group_attributes)
+            members[ou] = entry.member if 'member' in entry else ()
+            for dn in members[ou]:
+                member_of.setdefault(dn.lower(), set()).add(ou)
+        with self.lock:
+            self.users = users
+            self.groups = groups
+            self.members = members
+            self.member_of = member_of
+            self.csn = csn
+            self.version = version
+            self.loaded_at = time.monotonic()
+        print("Loaded directory replica with %d users and %d groups in %.1f s" % (len(users), len(groups), time.monotonic() - started))
+
+    def load_changes(self, version):
+        since = csn = self.csn
+        for entry in self.search_users('(entryCSN>=%s)' % since):
+            csn = max_csn(csn, entry)
+            self.put_user(entry)
+        for entry in self.search_groups('(entryCSN>=%s)' % since):
+            csn = max_csn(csn, entry)
+            self.put_group(entry)
+        with self.lock:
+            self.csn = csn
+            self.version = version
+
+    # Changes
+
+    def put_user(self, entry):
+        with self.lock:
+            self.users[str(entry.uid).lower()] = entry.project(self.user_attributes)
+
+    def put_group(self, entry):
+        ou = str(entry.ou).lower()
+        new_members = entry.member if 'member' in entry else ()
+        with self.lock:
+            self.remove_members(ou)
+            self.groups[ou] = entry.project(self.group_attributes)
+            self.members[ou] = new_members
+            for dn in new_members:
+                self.member_of.setdefault(dn.lower(), set()).add(ou)
+
+    def remove_members(self, ou):
+        """ Must be called with the lock held. """
+        for dn in self.members.pop(ou, ()):
+            ous = self.member_of.get(dn.lower())
+            if ous is not None:
+                ous.discard(ou)
+                if not ous:
+                    del self.member_of[dn.lower()]
+
+    def apply_group(self, ou, changes):
+        """ Applies the member changes of a modify of the group, in the format
+        of Connection.modify. The API writes no other replicated attributes. """
+        changes = [operations for attribute, operations in changes.items() if attribute.lower() == 'member']
+        if self.loaded_at is None or not changes:
+            return
+        ou = ou.lower()
+        with self.lock:
+            if ou in self.groups:
+                self.apply_members(ou, changes)
+                return
+        # not polled yet, read completely
+        self.refresh_group(ou)
+
+    def apply_members(self, ou, changes):
+        """ Must be called with the lock held. """
+        members = dict((dn.lower(), dn) for dn in self.members.get(ou, ()))
+        for operations in changes:
+            for operation, values in operations:
+                if operation == MODIFY_ADD:
+                    members.update((dn.lower(), dn) for dn in values)
+                elif operation == MODIFY_DELETE and values:
+                    for dn in values:
+                        members.pop(dn.lower(), None)
+                elif operation in (MODIFY_DELETE, MODIFY_REPLACE):
+                    # deleting without values removes the attribute
+                    members = dict((dn.lower(), dn) for dn in values)
+        self.remove_members(ou)
+        self.members[ou] = tuple(members.values())
+        for dn in members:
+            self.member_of.setdefault(dn, set()).add(ou)
+
+    def rename_user(self, old_dn, new_dn):
+        with self.lock:
+            ous = self.member_of.pop(old_dn.lower(), None)
+            if not ous:
+                return
+            self.member_of[new_dn.lower()] = ous
+            for ou in ous:
+                self.members[ou] = tuple(new_dn if dn.lower() == old_dn.lower() else dn for dn in self.members.get(ou, ()))
+
+    def refresh_user(self, uid):
+        if self.loaded_at is None:
+            return
+        entries = list(self.search_users('(uid=%s)' % escape_filter_chars(uid)))
+        with self.lock:
+            if entries:
+                self.put_user(entries[0])
+            else:
+                self.users.pop(uid.lower(), None)
+
+    def refresh_group(self, ou):
+        """ Reads the group again, after another process wrote to it. """
+        if self.loaded_at is None:
+            return
+        entries = list(self.search_groups('(ou=%s)' % escape_filter_chars(ou)))
+        with self.lock:
+            if entries:
+                self.put_group(entries[0])
+            else:
+                self.groups.pop(ou.lower(), None)
+                self.remove_members(ou.lower())
+
+    # Reads, these return what the LdapApi method of the same name returns
+
+    def get_user(self, uid, base=None):
+        with self.lock:
+            entry = self.users.get(uid.lower())
+        if entry is None or (base is not None and not self.api.is_dn_below(entry.entry_dn, base)):
+            return None
+        return entry
+
+    def get_group(self, ou):
+        with self.lock:
+            return self.groups.get(ou.lower())
+
+    def get_groups_as_member(self, user_dn):
+        with self.lock:
+            ous = self.member_of.get(user_dn.lower(), ())
+            return [self.groups[ou] for ou in ous if ou in self.groups]
+
+    def get_group_users(self, ou, base):
+        """ The members of the group below base, like the memberOf searches of LdapApi. """
+        with self.lock:
+            users = []
+            for dn in self.members.get(ou.lower(), ()):
+                if not self.api.is_dn_below(dn, base):
+                    continue
+                entry = self.users.get(dn_uid(dn))
+                if entry is not None and entry.entry_dn.lower() == dn.lower():
+                    users.append(entry)
+            return users
+
+def dn_uid(dn):
+    return dn.split(',')[0].split('=', 1)[1].lower()
+
+def max_csn(csn, entry):
+    values = [csn] if csn is not None else []
+    if 'entryCSN' in entry:
+        values.extend(entry.entryCSN.values)
+    return max(values) if values else None
@@ -0,0 +1,27 @@
+from ldap3.utils.conv import format_json
+
+JSON_TYPES = (str, int, float, bool, type(None))
+
+def json_value(value):
+    # same conversion entry_to_json applies to values json can't encode natively
+    if isinstance(value, JSON_TYPES):
+        return value
+    return format_json(value)
+
+def attribute_items(obj):
+    # works for ldap3 entries and for User and Group (models.py), without the
+    # deepcopy entry_attributes_as_dict makes of every value
+    return ((key, obj[key].values) for key in obj.entry_attributes)
+
+# converts ldap-style objects to python dicts with the first value of every attribute,
+# optionally restricted to the given attributes
+def object_to_dict(obj, attributes=None):
+    new_dictionary = {}
+    for key, values in attribute_items(obj):
+        if attributes is not None and key not in attributes:
+            continue
+        if len(values) >= 1:
+            new_dictionary[key.replace("-", "_")] = json_value(values[0])
+        else:
+            new_dictionary[key] = None
+    return new_dictionary
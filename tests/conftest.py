@@ -0,0 +1,78 @@
+import os
+import runpy
+import sys
+import types
+from ldap3 import Connection, MOCK_SYNC, MODIFY_REPLACE
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'test'
+
+def load_config():
+    """ Installs the settings of config.sample.py, pointed at a mock server, as the config module. """
+    config = types.ModuleType('config')
+    for key, value in runpy.run_path(os.path.join(ROOT, 'config.sample.py')).items():
+        if key.isupper():
+            setattr(config, key, value)
+    config.LDAP_HOST = 'test'
+    config.LDAP_CLIENT_STRATEGY = MOCK_SYNC
+    config.BIND_PW = PASSWORD
+    # the pool may only connect once the service account exists in the directory
+    config.LDAP_POOL_MIN_SIZE = 0
+    config.LDAP_CACHE_TTL = 0
+    config.JWT_SECRET = 'test-secret-of-at-least-32-bytes'
+    sys.modules['config'] = config
+    return config
+
+config = load_config()
+
+class Directory():
+    """ The mock directory the API reads from, written to by another client.
+    Like the syncprov overlay, every write gives the entry and the suffix a new CSN. """
+    def __init__(self, server):
+        self.counter = 0
+        self.dns = {}
+        self.conn = Connection(server, client_strategy=MOCK_SYNC)
+        self.conn.bind()
+        self.conn.strategy.add_entry(config.BIND_DN, {'objectClass': ['inetOrgPerson'], 'uid': 'dashboard', 'userPassword': PASSWORD})
+        self.conn.strategy.add_entry(config.LDAP_SUFFIX, {'objectClass': ['dcObject'], 'dc': 'sog', 'contextCSN': self.csn()})
+
+    def csn(self):
+        self.counter += 1
+        return '20260101000000.%06dZ#000000#000#000000' % self.counter
+
+    def touch_suffix(self):
+        self.conn.modify(config.LDAP_SUFFIX, {'contextCSN': [(MODIFY_REPLACE, [self.csn()])]})
+
+    def add_user(self, uid, groups=(), people=None):
+        """ Adds a user to people (DN_PEOPLE_ACTIVE by default), who is memberOf groups. """
+        self.dns[uid] = 'uid=%s,%s' % (uid, people or config.DN_PEOPLE_ACTIVE)
+        self.conn.strategy.add_entry(self.user_dn(uid), {
+            'objectClass': ['inetOrgPerson', 'top'], 'uid': uid, 'cn': uid.title(), 'sn': uid,
+            'mail': uid + '@studieren-ohne-grenzen.org', 'memberOf': [self.group_dn(x) for x in groups],
+            'userPassword': PASSWORD, 'entryCSN': self.csn(),
+        })
+        self.touch_suffix()
+
+    def add_group(self, ou, members, owners, pending=()):
+        self.conn.strategy.add_entry(self.group_dn(ou), {
+            'objectClass': ['groupOfNames', 'top'], 'ou': ou, 'cn': ou.title(), 'businessCategory': 'lokalgruppe',
+            'member': [self.user_dn(x) for x in members], 'owner': [self.user_dn(x) for x in owners],
+            'pending': [self.user_dn(x) for x in pending], 'entryCSN': self.csn(),
+        })
+        self.touch_suffix()
+
+    def modify(self, dn, changes):
+        self.conn.modify(dn, dict(changes, entryCSN=[(MODIFY_REPLACE, [self.csn()])]))
+        self.touch_suffix()
+
+    def delete(self, dn):
+        self.conn.delete(dn)
+        self.touch_suffix()
+
+    def user_dn(self, uid):
+        return self.dns.get(uid, 'uid=%s,%s' % (uid, config.DN_PEOPLE_ACTIVE))
+
+    def group_dn(self, ou):
+        return 'ou=%s,%s' % (ou, config.DN_GROUPS)
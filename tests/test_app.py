@@ -0,0 +1,145 @@
+import pytest
+from flask import g
+from ldap3 import MODIFY_ADD
+from conftest import config, Directory, PASSWORD
+from ldap_api import LdapApi
+import app
+import token_handler
+
+# Every budgeted route is called once, X-LDAP-Operations must stay at the
+# numbers below. Going over a route's budget raises LdapBudgetExceeded.
+
+@pytest.fixture
+def directory(monkeypatch):
+    api = LdapApi(config)
+    monkeypatch.setattr(app, 'api', api)
+    monkeypatch.setattr(app.app, 'testing', True)
+    directory = Directory(api.server)
+    directory.add_user('alice', ['allgemein', 'berlin'])
+    directory.add_user('bob', ['allgemein', 'berlin'])
+    directory.add_user('carol', ['allgemein'])
+    directory.add_user('dora', people=config.DN_PEOPLE_INACTIVE)
+    directory.add_user('gast', ['berlin'], people=config.DN_PEOPLE_GUESTS)
+    directory.add_group('allgemein', ['alice', 'bob', 'carol'], ['alice'])
+    directory.add_group('berlin', ['alice', 'bob', 'gast'], ['alice'], pending=['carol', 'dora'])
+    return directory
+
+@pytest.fixture
+def client(directory):
+    return app.app.test_client()
+
+def get(client, path, uid):
+    return client.get(path, headers={'Authorization': 'Bearer %s' % token_handler.create_session_jwt_token(uid)})
+
+def operations(response):
+    return int(response.headers['X-LDAP-Operations'])
+
+def uids(response):
+    return sorted(x['uid'] for x in response.json)
+
+def test_login(client):
+    response = client.post('/login', json={'username': 'bob', 'password': PASSWORD})
+    assert response.status_code == 200
+    assert token_handler.get_token_user_with_string(response.get_data(as_text=True)) == 'bob'
+    assert operations(response) == 3
+    response = client.post('/login', json={'username': 'bob', 'password': 'wrong'})
+    assert response.status_code == 403
+    assert operations(response) == 3
+    # the idle connection is anonymous again
+    [(conn, _)] = app.api.auth_pool.idle
+    assert conn.bound and conn.user == None and conn.password == None
+
+def test_inactive_info(client):
+    response = get(client, '/inactive_info', 'dora')
+    assert response.json['inactive'] == True
+    assert response.json['pending_group_name'] == 'Berlin'
+    assert [x['uid'] for x in response.json['pending_group_owners']] == ['alice']
+    assert operations(response) == 4
+    response = get(client, '/inactive_info', 'bob')
+    assert response.json == {'inactive': False}
+    assert operations(response) == 1
+
+def test_whoami(client):
+    response = get(client, '/whoami', 'bob')
+    assert response.json['uid'] == 'bob'
+    assert operations(response) == 1
+
+def test_users(client):
+    response = get(client, '/users', 'alice')
+    assert uids(response) == ['alice', 'bob', 'carol']
+    assert operations(response) == 3
+    # only group owners may list all users
+    response = get(client, '/users', 'bob')
+    assert response.status_code == 403
+    assert operations(response) == 2
+
+def test_users_page(client):
+    response = get(client, '/users?limit=2', 'alice')
+    assert uids(response) == ['alice', 'bob']
+    assert operations(response) == 4
+    response = get(client, '/users?limit=2&cursor=%s' % response.headers['X-Next-Cursor'], 'alice')
+    assert uids(response) == ['carol']
+    assert 'X-Next-Cursor' not in response.headers
+    assert operations(response) == 4
+
+def test_groups(client):
+    response = get(client, '/groups', 'bob')
+    assert sorted(x['ou'] for x in response.json) == ['allgemein', 'berlin']
+    assert operations(response) == 3
+
+def test_my_groups(client):
+    response = get(client, '/my_groups', 'carol')
+    assert dict((x['ou'], x['membership']) for x in response.json) == {'allgemein': 'member', 'berlin': 'pending'}
+    assert operations(response) == 3
+
+def test_owned_count(client):
+    response = get(client, '/my_groups/owned_count', 'alice')
+    assert response.json == {'count': 2}
+    assert operations(response) == 2
+
+def test_group_members(client):
+    response = get(client, '/groups/berlin/members', 'alice')
+    assert uids(response) == ['alice', 'bob']
+    assert operations(response) == 4
+    response = get(client, '/groups/berlin/members', 'bob')
+    assert response.status_code == 401
+    assert operations(response) == 2
+
+def test_group_members_operations_do_not_grow_with_the_group(client, directory):
+    for i in range(20):
+        uid = 'member%d' % i
+        directory.add_user(uid, ['allgemein'])
+        directory.modify(directory.group_dn('allgemein'), {'member': [(MODIFY_ADD, [directory.user_dn(uid)])]})
+    response = get(client, '/groups/allgemein/members', 'alice')
+    assert len(response.json) == 23
+    assert operations(response) == 4
+
+def test_group_guests(client):
+    response = get(client, '/groups/berlin/guests', 'alice')
+    assert uids(response) == ['gast']
+    assert operations(response) == 3
+
+def test_group_pending_members(client):
+    response = get(client, '/groups/berlin/active_pending_members', 'alice')
+    assert uids(response) == ['carol']
+    assert operations(response) == 4
+    response = get(client, '/groups/berlin/inactive_pending_members', 'alice')
+    assert uids(response) == ['dora']
+    assert operations(response) == 4
+
+def test_group_owners(client):
+    response = get(client, '/groups/berlin/owners', 'bob')
+    assert uids(response) == ['alice']
+    assert operations(response) == 3
+
+def test_going_over_the_budget_raises_in_testing_mode(directory):
+    @app.ldap_budget(3)
+    def route():
+        g.ldap_operations = 4
+        return 'ok'
+    with app.app.test_request_context('/'):
+        with pytest.raises(app.LdapBudgetExceeded):
+            route()
+    app.app.testing = False
+    with app.app.test_request_context('/'):
+        assert route() == 'ok'
@@ -0,0 +1,28 @@
+import pytest
+from ldap3 import MODIFY_REPLACE
+from ldap_api import LdapApi, LdapApiException
+from conftest import config, Directory
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(config, 'LDAP_CACHE_TTL', 30)
+    return LdapApi(config)
+
+@pytest.fixture
+def directory(api):
+    directory = Directory(api.server)
+    directory.add_user('alice')
+    return directory
+
+def test_found_users_are_cached(api, directory):
+    assert str(api.get_user('alice').cn) == 'Alice'
+    directory.modify(directory.user_dn('alice'), {'cn': [(MODIFY_REPLACE, ['Alicia'])]})
+    assert str(api.get_user('alice').cn) == 'Alice'
+    api.invalidate_user('alice')
+    assert str(api.get_user('alice').cn) == 'Alicia'
+
+def test_misses_are_not_cached(api, directory):
+    with pytest.raises(LdapApiException):
+        api.get_user('bob')
+    directory.add_user('bob')
+    assert str(api.get_user('bob').cn) == 'Bob'
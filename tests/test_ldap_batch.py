@@ -0,0 +1,77 @@
+import pytest
+from ldap3 import BASE
+from ldap_api import LdapApi
+from ldap_batch import LdapBatchException
+from conftest import config, Directory
+
+# A phase of activate_user or delete_user fails after earlier phases were
+# written, the WriteBatch has to undo those.
+
+@pytest.fixture
+def api():
+    return LdapApi(config)
+
+@pytest.fixture
+def directory(api):
+    directory = Directory(api.server)
+    directory.add_user('alice', ['allgemein', 'berlin'])
+    directory.add_user('bob', ['allgemein', 'berlin'])
+    directory.add_user('dora', people=config.DN_PEOPLE_INACTIVE)
+    directory.add_group('allgemein', ['alice', 'bob'], ['alice'])
+    directory.add_group('berlin', ['alice', 'bob'], ['alice', 'bob'], pending=['dora'])
+    directory.add_group('hamburg', ['alice'], ['alice'], pending=['dora'])
+    return directory
+
+def refuse(monkeypatch, api, method, dn):
+    """ Lets the server refuse api.method(dn, ...). """
+    write = getattr(api, method)
+    def refused(target, *args, **kwargs):
+        if target.lower() == dn.lower():
+            return {'result': 53, 'description': 'unwillingToPerform'}
+        return write(target, *args, **kwargs)
+    monkeypatch.setattr(api, method, refused)
+
+def values(directory, dn, attribute):
+    if not directory.conn.search(dn, '(objectClass=*)', search_scope=BASE, attributes=[attribute]):
+        return None
+    entry = directory.conn.entries[0]
+    return sorted(entry[attribute].values) if attribute in entry else []
+
+def test_activate_user_is_undone_if_the_last_phase_fails(api, directory, monkeypatch):
+    old_dn = directory.user_dn('dora')
+    new_dn = 'uid=dora,%s' % config.DN_PEOPLE_ACTIVE
+    refuse(monkeypatch, api, 'modify', directory.group_dn('allgemein'))
+    with pytest.raises(LdapBatchException):
+        api.activate_user('dora')
+    # moved back, pending again with the old DN
+    assert values(directory, old_dn, 'uid') == ['dora']
+    assert values(directory, new_dn, 'uid') == None
+    assert values(directory, directory.group_dn('berlin'), 'pending') == [old_dn]
+    assert values(directory, directory.group_dn('hamburg'), 'pending') == [old_dn]
+    assert len(values(directory, directory.group_dn('allgemein'), 'member')) == 2
+
+def test_activate_user_is_undone_if_the_move_fails(api, directory, monkeypatch):
+    old_dn = directory.user_dn('dora')
+    refuse(monkeypatch, api, 'modify_dn', old_dn)
+    with pytest.raises(LdapBatchException):
+        api.activate_user('dora')
+    assert values(directory, old_dn, 'uid') == ['dora']
+    assert values(directory, directory.group_dn('berlin'), 'pending') == [old_dn]
+    assert values(directory, directory.group_dn('hamburg'), 'pending') == [old_dn]
+
+def test_delete_user_is_undone_if_the_delete_fails(api, directory, monkeypatch):
+    dn = directory.user_dn('bob')
+    refuse(monkeypatch, api, 'delete', dn)
+    with pytest.raises(LdapBatchException):
+        api.delete_user('bob')
+    assert values(directory, dn, 'uid') == ['bob']
+    assert dn in values(directory, directory.group_dn('allgemein'), 'member')
+    assert dn in values(directory, directory.group_dn('berlin'), 'member')
+    assert dn in values(directory, directory.group_dn('berlin'), 'owner')
+
+def test_delete_user(api, directory):
+    dn = directory.user_dn('bob')
+    api.delete_user('bob')
+    assert values(directory, dn, 'uid') == None
+    assert dn not in values(directory, directory.group_dn('allgemein'), 'member')
+    assert dn not in values(directory, directory.group_dn('berlin'), 'owner')
@@ -0,0 +1,43 @@
+import pytest
+from ldap3 import MODIFY_ADD
+from ldap_api import LdapApi, LdapApiException
+from conftest import config, Directory
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'LDAP_MEMBERSHIP_INDEX', True)
+    monkeypatch.setattr(config, 'LDAP_INVALIDATION_DIR', str(tmp_path / 'invalidation'))
+    api = LdapApi(config)
+    # loaded by the tests instead of the background thread
+    api.index.stop()
+    return api
+
+@pytest.fixture
+def directory(api):
+    directory = Directory(api.server)
+    for uid in ('alice', 'bob'):
+        directory.add_user(uid, ['berlin'])
+    directory.add_group('berlin', ['alice', 'bob'], ['alice'])
+    api.index.load()
+    assert api.indexed() is api.index
+    return directory
+
+def test_needs_the_invalidation_bus(monkeypatch):
+    monkeypatch.setattr(config, 'LDAP_MEMBERSHIP_INDEX', True)
+    monkeypatch.setattr(config, 'LDAP_INVALIDATION_DIR', None)
+    with pytest.raises(LdapApiException):
+        LdapApi(config)
+
+def test_owners_are_answered_from_the_index(api, directory):
+    alice = directory.user_dn('alice')
+    assert api.get_owned_group_ous(alice) == ['berlin']
+    assert api.get_owned_group_ous(directory.user_dn('bob')) == []
+    # not seen without an invalidation or a reload
+    directory.modify(directory.group_dn('berlin'), {'owner': [(MODIFY_ADD, [directory.user_dn('bob')])]})
+    assert api.get_owned_group_ous(directory.user_dn('bob')) == []
+    api.handle_invalidation('group', 'berlin')
+    assert api.get_owned_group_ous(directory.user_dn('bob')) == ['berlin']
+
+def test_writes_through_the_api_are_applied_right_away(api, directory):
+    api.add_group_owner('berlin', 'bob')
+    assert api.get_owned_group_ous(directory.user_dn('bob')) == ['berlin']
@@ -0,0 +1,96 @@
+import pytest
+from ldap3 import MODIFY_ADD, MODIFY_REPLACE
+from ldap_api import LdapApi, LdapApiException
+from conftest import config, Directory
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(config, 'LDAP_REPLICA', True)
+    api = LdapApi(config)
+    # polled by the tests instead of the background thread
+    api.replica.stop()
+    return api
+
+@pytest.fixture
+def directory(api):
+    directory = Directory(api.server)
+    for uid in ('alice', 'bob', 'carol'):
+        directory.add_user(uid, ['allgemein'])
+    directory.add_group('allgemein', ['alice', 'bob', 'carol'], ['alice'])
+    directory.add_group('berlin', ['alice'], ['alice'])
+    api.replica.load()
+    assert api.replicated() is api.replica
+    return directory
+
+def member_uids(api, group):
+    return sorted(str(x.uid) for x in api.get_group_members(group))
+
+def test_reads_are_served_from_the_replica(api, directory):
+    # gone from LDAP without a new CSN, the replica doesn't notice
+    directory.conn.server.dit.pop(directory.user_dn('carol'))
+    assert str(api.get_user('carol').cn) == 'Carol'
+    assert member_uids(api, 'allgemein') == ['alice', 'bob', 'carol']
+    assert str(api.get_group('berlin').cn) == 'Berlin'
+
+def test_changes_of_other_writers_arrive_with_the_next_poll(api, directory):
+    directory.modify(directory.user_dn('bob'), {'cn': [(MODIFY_REPLACE, ['Robert'])]})
+    directory.modify(directory.group_dn('berlin'), {'member': [(MODIFY_ADD, [directory.user_dn('bob')])]})
+    assert str(api.get_user('bob').cn) == 'Bob'
+    api.replica.poll()
+    assert str(api.get_user('bob').cn) == 'Robert'
+    assert member_uids(api, 'berlin') == ['alice', 'bob']
+    assert sorted(str(x.ou) for x in api.get_groups_as_member('bob')) == ['allgemein', 'berlin']
+
+def test_entries_added_by_other_writers_arrive_with_the_next_poll(api, directory):
+    directory.add_user('dora')
+    directory.add_group('hamburg', ['dora'], ['dora'])
+    with pytest.raises(LdapApiException):
+        api.get_user('dora')
+    api.replica.poll()
+    assert str(api.get_user('dora').cn) == 'Dora'
+    assert member_uids(api, 'hamburg') == ['dora']
+
+def test_writes_through_the_api_are_visible_right_away(api, directory):
+    api.add_group_member('berlin', 'carol')
+    assert member_uids(api, 'berlin') == ['alice', 'carol']
+    api.remove_group_member('allgemein', 'bob')
+    assert member_uids(api, 'allgemein') == ['alice', 'carol']
+
+def test_writes_through_the_api_are_applied_without_reading_the_group(api, directory, monkeypatch):
+    def search_groups(search_filter):
+        raise AssertionError('searched %s' % search_filter)
+    monkeypatch.setattr(api.replica, 'search_groups', search_groups)
+    api.add_group_member('berlin', 'bob')
+    assert member_uids(api, 'berlin') == ['alice', 'bob']
+    assert sorted(str(x.ou) for x in api.get_groups_as_member('bob')) == ['allgemein', 'berlin']
+    api.remove_group_member('allgemein', 'carol')
+    assert member_uids(api, 'allgemein') == ['alice', 'bob']
+    assert api.get_groups_as_member('carol') == []
+
+def test_groups_written_by_other_workers_are_read_on_invalidation(api, directory):
+    directory.conn.modify(directory.group_dn('berlin'), {'member': [(MODIFY_ADD, [directory.user_dn('carol')])]})
+    assert member_uids(api, 'berlin') == ['alice']
+    api.handle_invalidation('group', 'berlin')
+    assert member_uids(api, 'berlin') == ['alice', 'carol']
+
+def test_deletes_through_the_api_are_visible_right_away(api, directory):
+    api.delete_user('bob')
+    with pytest.raises(LdapApiException):
+        api.get_user('bob')
+    assert member_uids(api, 'allgemein') == ['alice', 'carol']
+
+def test_deletes_of_other_writers_disappear_with_the_next_load(api, directory):
+    directory.delete(directory.user_dn('bob'))
+    directory.delete(directory.group_dn('berlin'))
+    # polling only finds entries with a newer entryCSN, deletions aren't seen
+    api.replica.poll()
+    assert str(api.get_user('bob').cn) == 'Bob'
+    assert member_uids(api, 'allgemein') == ['alice', 'bob', 'carol']
+    api.replica.reload_interval = 0
+    api.replica.poll()
+    with pytest.raises(LdapApiException):
+        api.get_user('bob')
+    with pytest.raises(LdapApiException):
+        api.get_group('berlin')
+    # the member value of the deleted user is left, but no user to list for it
+    assert member_uids(api, 'allgemein') == ['alice', 'carol']
@@ -1,6 +1,16 @@
 import config
 import datetime
+import threading
+import time
 import jwt
+from collections import OrderedDict
+
+# Tokens that were verified before, token string -> (username, exp).
+# Checking a cached token is a dict lookup instead of a HMAC verification,
+# tokens are dropped once they expire.
+verified_tokens = OrderedDict()
+verified_tokens_lock = threading.Lock()
+VERIFIED_TOKENS_SIZE = 10000
 
 # Erzeugt ein JWT Token für einen Nutzer
 def create_session_jwt_token(username):
@@ -35,8 +45,22 @@ def get_jwt_user(header):
     return get_token_user_with_string(header_fields[1])
 
 def get_token_user_with_string(token_str):
+    with verified_tokens_lock:
+        cached = verified_tokens.get(token_str)
+        if cached is not None:
+            if cached[1] > time.time():
+                verified_tokens.move_to_end(token_str)
+                return cached[0]
+            del verified_tokens[token_str]
     try:
-        jwt_user = jwt.decode(token_str, config.JWT_SECRET, algorithms=['HS256']).get("username")
+        token = jwt.decode(token_str, config.JWT_SECRET, algorithms=['HS256'])
     except jwt.InvalidTokenError:
         return None
+    jwt_user = token.get("username")
+    # only tokens that expire can be cached
+    if isinstance(token.get("exp"), (int, float)):
+        with verified_tokens_lock:
+            verified_tokens[token_str] = (jwt_user, token["exp"])
+            while len(verified_tokens) > VERIFIED_TOKENS_SIZE:
+                verified_tokens.popitem(last=False)
     return jwt_user